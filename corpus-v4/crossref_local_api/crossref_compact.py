@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Compact storage layout for the local Crossref database, and a migration tool
+that converts an existing database to it.
+
+The standard layout keeps every DOI twice (in the papers table and in the
+index behind its UNIQUE constraint), an AUTOINCREMENT id, two timestamps and
+the full journal and publisher names on every row. The compact layout stores:
+
+- papers as a WITHOUT ROWID table with the canonical DOI (lowercased, without
+  resolver prefix, see crossref_doi.py) as primary key, so the DOI B-tree is
+  the table itself
+- journal and publisher names once each, in lookup tables keyed by small integers
+- the published date as a packed integer YYYYMMDD, with 00 for a missing
+  month or day (2005-03 is 20050300)
+
+A smaller file means more of the DOI B-tree stays in the page cache, which is
+what makes lookups fast. The compact database is read-only as far as
+CrossrefDB is concerned: import into a standard database, then migrate it.
+
+Usage:
+    python crossref_compact.py /Volumes/Storage/crossref/crossref-api.db /Volumes/Storage/crossref/crossref-compact.db
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, Optional
+
+from crossref_doi import normalize_doi
+from crossref_records import RECORD_SCHEMA
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+COMPACT_SCHEMA = [
+    '''
+    CREATE TABLE journals (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE publishers (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE papers (
+        doi TEXT PRIMARY KEY,
+        journal_id INTEGER REFERENCES journals(id),
+        publisher_id INTEGER REFERENCES publishers(id),
+        published_date INTEGER
+    ) WITHOUT ROWID
+    ''',
+]
+
+# PRAGMA user_version of compact databases; version 1 keys papers by canonical DOI
+COMPACT_FORMAT_VERSION = 1
+
+COMPACT_INDEXES = [
+    'CREATE INDEX idx_journal_id ON papers(journal_id)',
+    'CREATE INDEX idx_publisher_id ON papers(publisher_id)',
+]
+
+
+def pack_date(date: Optional[str]) -> Optional[int]:
+    """
+    Pack a date string as written by the importer ('2005-03-01', '2005-03' or
+    '2005', or a full date-time) into an integer YYYYMMDD.
+
+    A date-time keeps only its date. Returns None for an empty or unparseable date.
+    """
+    if not date:
+        return None
+    parts = date[:10].split('-')
+    try:
+        year = int(parts[0])
+        month = int(parts[1]) if len(parts) > 1 else 0
+        day = int(parts[2]) if len(parts) > 2 else 0
+    except ValueError:
+        return None
+    if not (0 <= month <= 12 and 0 <= day <= 31):
+        return None
+    return year * 10000 + month * 100 + day
+
+
+def unpack_date(packed: Optional[int]) -> str:
+    """Format a packed YYYYMMDD date the way the importer writes dates ('' when missing)"""
+    if packed is None:
+        return ''
+    year, month_day = divmod(packed, 10000)
+    month, day = divmod(month_day, 100)
+    if day:
+        return f"{year}-{month:02d}-{day:02d}"
+    if month:
+        return f"{year}-{month:02d}"
+    return str(year)
+
+
+# Papers with their journal and publisher names, filtered by the caller's WHERE clause
+COMPACT_PAPERS_SELECT = '''
+    SELECT p.doi, j.name AS journal, pub.name AS publisher, p.published_date
+    FROM papers p
+    LEFT JOIN journals j ON j.id = p.journal_id
+    LEFT JOIN publishers pub ON pub.id = p.publisher_id
+'''
+
+COMPACT_TOP_PUBLISHERS_QUERY = '''
+    SELECT pub.name AS publisher, c.count
+    FROM (
+        SELECT publisher_id, COUNT(*) AS count
+        FROM papers
+        WHERE publisher_id IS NOT NULL
+        GROUP BY publisher_id
+        ORDER BY count DESC
+        LIMIT 10
+    ) c
+    JOIN publishers pub ON pub.id = c.publisher_id
+    ORDER BY c.count DESC
+'''
+
+
+def compact_row_to_paper(row) -> Dict:
+    """
+    Turn a COMPACT_PAPERS_SELECT row into the fields of a standard papers row
+
+    The original spelling of the DOI isn't kept, so 'doi' is the canonical key
+    (lowercased), where a standard database returns the DOI as imported.
+    """
+    return {
+        'doi': row['doi'],
+        'journal': row['journal'] or '',
+        'publisher': row['publisher'] or '',
+        'published_date': unpack_date(row['published_date']),
+    }
+
+
+def is_compact(conn, schema: str = 'main') -> bool:
+    """True if the database uses the compact layout"""
+    columns = {row[1] for row in conn.execute(f'PRAGMA {schema}.table_info(papers)')}
+    return 'journal_id' in columns
+
+
+def has_compact_doi_keys(conn) -> bool:
+    """True if a compact database is keyed by canonical DOI (converted by this version or later)"""
+    return conn.execute('PRAGMA user_version').fetchone()[0] >= COMPACT_FORMAT_VERSION
+
+
+def migrate(source_path: str, target_path: str):
+    """
+    Copy a standard Crossref database into a new database with the compact layout.
+
+    The target is built under a temporary name and renamed once it is complete,
+    so an interrupted migration never leaves a half-written database behind.
+    """
+    if os.path.exists(target_path):
+        raise FileExistsError(f"{target_path} already exists")
+    building_path = target_path + '.building'
+    if os.path.exists(building_path):
+        os.remove(building_path)
+
+    start = time.perf_counter()
+    conn = sqlite3.connect(f'file:{building_path}', uri=True)
+    try:
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('PRAGMA cache_size = 100000')
+        conn.create_function('pack_date', 1, pack_date, deterministic=True)
+        conn.create_function('normalize_doi', 1, normalize_doi, deterministic=True)
+        conn.execute('ATTACH DATABASE ? AS source', (f'file:{source_path}?mode=ro',))
+        if is_compact(conn, 'source'):
+            raise ValueError(f"{source_path} already uses the compact layout")
+
+        for statement in COMPACT_SCHEMA:
+            conn.execute(statement)
+
+        logger.info("Interning journal and publisher names...")
+        conn.execute('''
+            INSERT INTO journals (name)
+            SELECT DISTINCT journal FROM source.papers WHERE journal != '' ORDER BY journal
+        ''')
+        conn.execute('''
+            INSERT INTO publishers (name)
+            SELECT DISTINCT publisher FROM source.papers WHERE publisher != '' ORDER BY publisher
+        ''')
+        conn.commit()
+
+        logger.info("Copying papers in DOI order...")
+        # Sorted by key, so inserts append to the new primary key. DOIs that only differ
+        # in case share a key; only one of them is kept.
+        source_columns = {row[1] for row in conn.execute('PRAGMA source.table_info(papers)')}
+        doi_key = 'coalesce(p.doi_key, normalize_doi(p.doi))' if 'doi_key' in source_columns else 'normalize_doi(p.doi)'
+        conn.execute(f'''
+            INSERT OR IGNORE INTO papers (doi, journal_id, publisher_id, published_date)
+            SELECT {doi_key} AS doi_key, j.id, pub.id, pack_date(p.published_date)
+            FROM source.papers p
+            LEFT JOIN journals j ON j.name = p.journal
+            LEFT JOIN publishers pub ON pub.name = p.publisher
+            ORDER BY doi_key
+        ''')
+        conn.commit()
+
+        has_records = conn.execute(
+            "SELECT 1 FROM source.sqlite_master WHERE type = 'table' AND name = 'paper_records'"
+        ).fetchone() is not None
+        if has_records:
+            # Stored records (crossref_records.py) are kept as they are, keyed like papers
+            logger.info("Copying stored records...")
+            for statement in RECORD_SCHEMA:
+                conn.execute(statement)
+            conn.execute('''
+                INSERT INTO record_dictionaries (id, dictionary, samples, created_at)
+                SELECT id, dictionary, samples, created_at FROM source.record_dictionaries
+            ''')
+            conn.execute(f'''
+                INSERT OR IGNORE INTO paper_records (doi, dictionary_id, record)
+                SELECT {doi_key} AS doi_key, r.dictionary_id, r.record
+                FROM source.paper_records r
+                JOIN source.papers p ON p.doi = r.doi
+                ORDER BY doi_key
+            ''')
+            conn.commit()
+
+        logger.info("Building indexes...")
+        for statement in COMPACT_INDEXES:
+            conn.execute(statement)
+        conn.execute('ANALYZE main')
+        conn.execute(f'PRAGMA user_version = {COMPACT_FORMAT_VERSION}')
+        conn.commit()
+
+        papers = conn.execute('SELECT COUNT(*) FROM papers').fetchone()[0]
+        conn.execute('DETACH DATABASE source')
+        conn.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        conn.close()
+
+    os.replace(building_path, target_path)
+    source_size = os.path.getsize(source_path)
+    target_size = os.path.getsize(target_path)
+    logger.info(f"Migrated {papers} papers in {time.perf_counter() - start:.0f}s: "
+                f"{source_size / 1e9:.2f} GB -> {target_size / 1e9:.2f} GB "
+                f"({target_size / source_size:.0%} of the original size)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a Crossref SQLite database to the compact layout")
+    parser.add_argument('source', help="Existing database with the standard layout (only read)")
+    parser.add_argument('target', help="Path of the compact database to create")
+    args = parser.parse_args()
+    migrate(args.source, args.target)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Canonical form of a DOI, used as the lookup key of the local Crossref database
+
+DOIs are case-insensitive and get written with or without a resolver prefix
+(assertions.publication uses https://doi.org/...), so both the importer and
+every lookup reduce them to the same key: the bare DOI, lowercased.
+"""
+
+from typing import Optional
+
+# Resolver and scheme prefixes stripped from a DOI, matched case-insensitively
+DOI_PREFIXES = (
+    'https://doi.org/',
+    'http://doi.org/',
+    'https://dx.doi.org/',
+    'http://dx.doi.org/',
+    'doi.org/',
+    'doi:',
+)
+
+
+def normalize_doi(doi: Optional[str]) -> str:
+    """
+    Canonical key of a DOI: surrounding whitespace and resolver prefix removed, lowercased
+
+    e.g. "https://doi.org/10.1042/BJ20130269" -> "10.1042/bj20130269"
+    """
+    if not doi:
+        return ''
+    key = doi.strip().lower()
+    for prefix in DOI_PREFIXES:
+        if key.startswith(prefix):
+            key = key[len(prefix):].lstrip()
+            break
+    return key
@@ -9,32 +9,214 @@ import json
 import gzip
 import os
 from pathlib import Path
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Iterable, Iterator, Tuple
 from datetime import datetime
 import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import contextmanager
+from dataclasses import dataclass, field
+from itertools import islice
+
+from crossref_doi import normalize_doi
+from crossref_compact import (COMPACT_PAPERS_SELECT, COMPACT_TOP_PUBLISHERS_QUERY, compact_row_to_paper,
+                              has_compact_doi_keys, is_compact)
+from crossref_records import (RECORD_SCHEMA, make_compressor, make_decompressor, require_zstandard, select_fields,
+                              train_dictionary)
+from lookup_cache import LookupCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@dataclass
+class DecodedFile:
+    """Papers extracted from one .jsonl.gz file by a decode worker"""
+    file_name: str
+    papers: List[tuple] = field(default_factory=list)
+    line_numbers: List[int] = field(default_factory=list)  # source line of each paper
+    records: List[tuple] = field(default_factory=list)  # (doi, dictionary_id, compressed record) of each paper
+    lines: int = 0
+    decode_seconds: float = 0.0
+    error: Optional[str] = None
+
+
+def decode_jsonl_file(gz_file: Path, start_line: int = 0,
+                      record_dictionary: Optional[Tuple[int, bytes]] = None) -> DecodedFile:
+    """
+    Decompress and parse one .jsonl.gz file into (doi, journal, publisher, published_date, doi_key) tuples.
+    
+    Runs in a worker process, so it only reads the file and never touches the database.
+    The first ``start_line`` lines, already imported by an interrupted run, are skipped.
+    With a (dictionary id, dictionary) ``record_dictionary``, every record is also
+    compressed with it for paper_records.
+    """
+    start = time.perf_counter()
+    result = DecodedFile(file_name=gz_file.name, lines=start_line)
+    compressor = None
+    if record_dictionary is not None:
+        dictionary_id, dictionary = record_dictionary
+        compressor = make_compressor(dictionary)
+    try:
+        with gzip.open(gz_file, 'rt', encoding='utf-8') as f:
+            for line_num, line in enumerate(f, 1):
+                if line_num <= start_line:
+                    continue
+                result.lines = line_num
+                try:
+                    line = line.strip()
+                    record = json.loads(line)
+                    
+                    # Extract key fields
+                    doi = record.get('DOI', '')
+                    journal = CrossrefDB._extract_journal(record)
+                    publisher = record.get('publisher', '')
+                    published_date = CrossrefDB._extract_date(record.get('published', {}))
+                    
+                    result.papers.append((
+                        doi, journal, publisher, published_date, normalize_doi(doi)
+                    ))
+                    result.line_numbers.append(line_num)
+                    if compressor is not None:
+                        result.records.append((doi, dictionary_id, compressor.compress(line.encode('utf-8'))))
+                    
+                except json.JSONDecodeError:
+                    logger.warning(f"Invalid JSON in {gz_file.name}, line {line_num}")
+                except Exception as e:
+                    logger.error(f"Error processing record in {gz_file.name}, line {line_num}: {e}")
+    except Exception as e:
+        result.error = str(e)
+    result.decode_seconds = time.perf_counter() - start
+    return result
+
+
+@dataclass
+class ImportJob:
+    """A file to import, with the progress an earlier run already committed"""
+    path: Path
+    file_size: int
+    file_mtime: float
+    start_line: int = 0
+    rows: int = 0
+
+
+class ImportStats:
+    """Throughput of the decode and write stages of an import"""
+    
+    REPORT_EVERY = 500000
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files = 0
+        self.skipped = 0
+        self.decoded = 0
+        self.decode_seconds = 0.0
+        self.written = 0
+        self.write_seconds = 0.0
+        self._next_report = self.REPORT_EVERY
+    
+    def add_decoded(self, result: DecodedFile):
+        self.files += 1
+        self.decoded += len(result.papers)
+        self.decode_seconds += result.decode_seconds
+    
+    def add_written(self, records: int, seconds: float):
+        self.written += records
+        self.write_seconds += seconds
+    
+    def should_report(self) -> bool:
+        if self.written < self._next_report:
+            return False
+        self._next_report = self.written + self.REPORT_EVERY
+        return True
+    
+    def report(self) -> str:
+        """
+        Records/s of each stage: decode per worker (records over worker CPU time),
+        write (records over time spent in SQLite) and overall (records over wall time)
+        """
+        elapsed = time.perf_counter() - self.started
+        decode_rate = self.decoded / self.decode_seconds if self.decode_seconds else 0
+        write_rate = self.written / self.write_seconds if self.write_seconds else 0
+        overall_rate = self.written / elapsed if elapsed else 0
+        return (f"{self.files} files ({self.skipped} already imported), {self.written} records in {elapsed:.0f}s | "
+                f"decode: {decode_rate:,.0f} records/s per worker | "
+                f"write: {write_rate:,.0f} records/s | "
+                f"overall: {overall_rate:,.0f} records/s")
+
+
+# Indexes on papers besides the DOI unique constraint, as (index name, column)
+SECONDARY_INDEXES = [
+    ('idx_doi_key', 'doi_key'),
+    ('idx_journal', 'journal'),
+    ('idx_publisher', 'publisher'),
+]
+# Lookups go through the canonical DOI key once this index exists
+DOI_KEY_INDEX = 'idx_doi_key'
+
+
+
 class CrossrefDB:
     """Database manager for Crossref academic papers"""
     
-    def __init__(self, db_path: str):
+    # Defaults for the per-thread read-only connections used by lookups
+    READ_MMAP_SIZE = 4 * 1024 ** 3  # bytes of the file mapped into memory (capped by SQLite's compile-time limit)
+    READ_CACHE_SIZE_KB = 64 * 1024  # page cache per connection
+    
+    # Defaults for the in-process cache of DOI lookups
+    LOOKUP_CACHE_SIZE = 100000  # entries
+    LOOKUP_CACHE_TTL = 3600.0  # seconds
+    # How often lookups check whether another connection or process wrote to the database
+    DATA_VERSION_CHECK_INTERVAL = 1.0  # seconds
+    
+    def __init__(self, db_path: str, mmap_size: int = READ_MMAP_SIZE, cache_size_kb: int = READ_CACHE_SIZE_KB,
+                 lookup_cache_size: int = LOOKUP_CACHE_SIZE, lookup_cache_ttl: float = LOOKUP_CACHE_TTL):
         """
         Initialize database connection
         
         Args:
             db_path: Path to SQLite database (can be on external drive)
                     e.g., "/Volumes/MyDrive/crossref.db" or "D:/crossref.db"
+            mmap_size: Bytes of the database to memory-map in read connections (0 disables mmap)
+            cache_size_kb: Page cache size of each read connection, in KiB
+            lookup_cache_size: Number of DOI lookups (found or not) to keep in memory (0 disables the cache)
+            lookup_cache_ttl: Seconds a cached lookup stays valid
         """
         self.db_path = db_path
+        self.compact = False
+        self.doi_keys = False
+        self.has_records = False
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self._local = threading.local()
+        self._read_connections = []
+        self._read_connections_lock = threading.Lock()
+        self.lookup_cache = LookupCache(lookup_cache_size, lookup_cache_ttl) if lookup_cache_size > 0 else None
+        self._version_conn = None
+        self._data_version = None
+        self._next_version_check = 0.0
+        self._version_lock = threading.Lock()
         self.ensure_database_exists()
         
     def ensure_database_exists(self):
         """Create database and tables if they don't exist"""
         with self.get_connection() as conn:
+            # Full records are only stored by imports with store_records=True (see crossref_records.py)
+            self.has_records = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'paper_records'"
+            ).fetchone() is not None
+            if is_compact(conn):
+                # Converted by crossref_compact.py, read-only
+                self.compact = True
+                self.doi_keys = has_compact_doi_keys(conn)
+                if not self.doi_keys:
+                    logger.warning(f"{self.db_path} was converted before DOI keys were added; lookups are "
+                                   f"case-sensitive until it is converted again with crossref_compact.py")
+                logger.info(f"Using compact database at {self.db_path}")
+                return
+            
             conn.execute('''
                 CREATE TABLE IF NOT EXISTS papers (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -43,17 +225,87 @@ class CrossrefDB:
                     publisher TEXT,
                     published_date TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    local_indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    local_indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    doi_key TEXT
                 )
             ''')
             
-            conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_doi_primary ON papers(doi)')
-            conn.execute('CREATE INDEX IF NOT EXISTS idx_journal ON papers(journal)')
-            conn.execute('CREATE INDEX IF NOT EXISTS idx_publisher ON papers(publisher)')
+            # doi_key (see crossref_doi.normalize_doi) was added after the first imports
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(papers)')}
+            if 'doi_key' not in columns:
+                conn.execute('ALTER TABLE papers ADD COLUMN doi_key TEXT')
+            
+            # The UNIQUE constraint on doi already has its own index; idx_doi_primary
+            # duplicated it and only slowed down every insert
+            conn.execute('DROP INDEX IF EXISTS idx_doi_primary')
+            # Only index doi_key once every row has one, lookups rely on the index being complete
+            self.doi_keys = self._has_index(conn, DOI_KEY_INDEX) or not conn.execute(
+                'SELECT 1 FROM papers WHERE doi_key IS NULL LIMIT 1'
+            ).fetchone()
+            if not self.doi_keys:
+                logger.warning(f"Papers in {self.db_path} have no DOI keys yet; lookups are case-sensitive "
+                               f"until add_doi_keys() has run")
+            self._create_secondary_indexes(conn, include_doi_key=self.doi_keys)
+            
+            # Import ledger: one row per .jsonl.gz file, written in the same transaction as
+            # its papers. lines_done is the last committed line of a file still in flight.
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS import_progress (
+                    file_name TEXT PRIMARY KEY,
+                    file_size INTEGER NOT NULL,
+                    file_mtime REAL NOT NULL,
+                    rows INTEGER NOT NULL DEFAULT 0,
+                    lines_done INTEGER NOT NULL DEFAULT 0,
+                    completed_at TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
             
             conn.commit()
             logger.info(f"Database initialized at {self.db_path}")
     
+    def _create_secondary_indexes(self, conn, include_doi_key: bool = True):
+        """Create the papers indexes other than the DOI unique constraint"""
+        for index_name, column in SECONDARY_INDEXES:
+            if index_name == DOI_KEY_INDEX and not include_doi_key:
+                continue
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON papers({column})')
+    
+    @staticmethod
+    def _has_index(conn, index_name: str) -> bool:
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index_name,)
+        ).fetchone() is not None
+    
+    def add_doi_keys(self, batch_size: int = 1000000):
+        """
+        Fill in doi_key for papers imported before the column existed, then index it
+        
+        Rows are updated in id ranges of ``batch_size``, each in its own transaction,
+        so an interrupted run continues where it stopped.
+        """
+        if self.compact:
+            raise ValueError("Compact databases get their DOI keys when they are converted")
+        with self.get_connection() as conn:
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.create_function('normalize_doi', 1, normalize_doi, deterministic=True)
+            max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM papers').fetchone()[0]
+            start = time.perf_counter()
+            for low in range(0, max_id + 1, batch_size):
+                conn.execute(
+                    'UPDATE papers SET doi_key = normalize_doi(doi) WHERE id >= ? AND id < ? AND doi_key IS NULL',
+                    (low, low + batch_size)
+                )
+                conn.commit()
+                logger.info(f"DOI keys added up to id {min(low + batch_size, max_id)} of {max_id} "
+                            f"({time.perf_counter() - start:.0f}s)")
+            logger.info("Indexing DOI keys...")
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {DOI_KEY_INDEX} ON papers(doi_key)')
+            conn.commit()
+        self.doi_keys = True
+        self.invalidate_cache()
+    
     @contextmanager
     def get_connection(self):
         """Context manager for database connections"""
@@ -64,25 +316,129 @@ class CrossrefDB:
         finally:
             conn.close()
     
-    def import_jsonl_files(self, data_directory: str, batch_size: int = 10000):
+    def get_read_connection(self) -> sqlite3.Connection:
+        """
+        Read-only connection of the calling thread, opened on first use and reused afterwards
+        
+        Reusing the connection keeps its schema, page cache, memory map and prepared
+        statements across lookups, instead of paying for them on every request. It is
+        opened with mode=ro, so lookups can never write; in WAL mode each query still
+        sees the latest committed import.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open_read_connection()
+            conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+            conn.execute(f'PRAGMA cache_size = {-int(self.cache_size_kb)}')
+            conn.execute('PRAGMA temp_store = MEMORY')
+            self._local.conn = conn
+            with self._read_connections_lock:
+                self._read_connections.append(conn)
+        return conn
+    
+    def _open_read_connection(self) -> sqlite3.Connection:
+        uri = Path(self.db_path).resolve().as_uri() + '?mode=ro'
+        # Only ever used by one thread at a time; close() may close it from another one at shutdown
+        conn = sqlite3.connect(uri, uri=True, timeout=30.0, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def close(self):
+        """Close the read-only connections of all threads"""
+        with self._read_connections_lock:
+            connections, self._read_connections = self._read_connections, []
+        with self._version_lock:
+            if self._version_conn is not None:
+                connections.append(self._version_conn)
+                self._version_conn = None
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+    
+    def invalidate_cache(self):
+        """Drop all cached lookups"""
+        if self.lookup_cache is not None:
+            self.lookup_cache.clear()
+    
+    def cache_stats(self) -> Dict:
+        """Hit/miss/eviction counters of the lookup cache"""
+        if self.lookup_cache is None:
+            return {'enabled': False}
+        return dict(self.lookup_cache.stats(), enabled=True)
+    
+    def _check_for_writes(self):
+        """
+        Invalidate the lookup cache if the database changed since the last check
+        
+        PRAGMA data_version changes whenever another connection, in this or any other
+        process (e.g. an import running next to the web API), commits to the database.
+        It is polled at most every DATA_VERSION_CHECK_INTERVAL seconds, on a connection
+        of its own because the value is only comparable on the same connection.
+        """
+        now = time.monotonic()
+        if now < self._next_version_check:
+            return
+        with self._version_lock:
+            if now < self._next_version_check:
+                return
+            self._next_version_check = now + self.DATA_VERSION_CHECK_INTERVAL
+            if self._version_conn is None:
+                self._version_conn = self._open_read_connection()
+            data_version = self._version_conn.execute('PRAGMA data_version').fetchone()[0]
+            if self._data_version is not None and data_version != self._data_version:
+                self.invalidate_cache()
+            self._data_version = data_version
+    
+    def import_jsonl_files(self, data_directory: str, batch_size: int = 10000,
+                           workers: Optional[int] = None, commit_size: int = 500000,
+                           resume: bool = True, bulk_load: Optional[bool] = None,
+                           store_records: bool = False):
         """
         Import all .jsonl.gz files from directory into database
         
+        Files are decompressed and parsed by a pool of worker processes, which send
+        back (doi, journal, publisher, published_date) tuples. This process is the
+        only writer and inserts them in transactions of ``commit_size`` records.
+        Results are written in file order, so duplicate DOIs resolve the same way
+        as a sequential import.
+        
+        Every commit also records the progress of the current file in the
+        import_progress table. A rerun skips files that were completely imported
+        (same name, size and mtime) and continues a partly imported file after its
+        last committed line.
+        
+        Bulk-load mode, for the initial import into an empty papers table, appends
+        records to an index-free papers_staging table instead. Once every file is
+        loaded, the staging table is deduplicated (the last occurrence of a DOI wins,
+        as with INSERT OR REPLACE), copied into papers in DOI order and the indexes
+        are built once, all in one transaction.
+        
         Args:
             data_directory: Directory containing .jsonl.gz files
             batch_size: Number of records to insert at once (default: 10000 for faster imports)
+            workers: Number of decode processes (default: one per CPU, minus the writer);
+                     1 decodes in this process without a pool
+            commit_size: Number of records per transaction (default: 500000)
+            resume: Skip work recorded in import_progress; False clears it and imports every file again
+            bulk_load: Load through the staging table (default: when papers is empty)
+            store_records: Also keep every full record, zstd-compressed, in paper_records
+                           (see crossref_records.py; needs the zstandard package)
         """
+        if self.compact:
+            raise ValueError(f"{self.db_path} uses the compact layout and is read-only; import into a "
+                             f"standard database and convert it with crossref_compact.py")
+        
         data_path = Path(data_directory)
-        gz_files = list(data_path.glob("*.jsonl.gz"))
+        gz_files = sorted(data_path.glob("*.jsonl.gz"))
         
         if not gz_files:
             logger.error(f"No .jsonl.gz files found in {data_directory}")
             return
         
-        logger.info(f"Found {len(gz_files)} files to process")
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 2) - 1)
         
-        total_imported = 0
-        batch_data = []
+        stats = ImportStats()
         
         with self.get_connection() as conn:
             # Optimize SQLite for bulk inserts
@@ -91,72 +447,258 @@ class CrossrefDB:
             conn.execute('PRAGMA cache_size = 100000')
             conn.execute('PRAGMA temp_store = MEMORY')
             
-            # Begin transaction for the entire import
+            if not resume:
+                conn.execute('DELETE FROM import_progress')
+                conn.commit()
+            papers_empty = conn.execute('SELECT NOT EXISTS (SELECT 1 FROM papers)').fetchone()[0]
+            if bulk_load is None:
+                bulk_load = papers_empty
+            elif bulk_load and not papers_empty:
+                raise ValueError("Bulk-load mode needs an empty papers table")
+            if bulk_load:
+                if not resume:
+                    conn.execute('DROP TABLE IF EXISTS papers_staging')
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS papers_staging (
+                        doi TEXT,
+                        journal TEXT,
+                        publisher TEXT,
+                        published_date TEXT,
+                        doi_key TEXT
+                    )
+                ''')
+                conn.commit()
+                logger.info("Bulk-load mode: loading into papers_staging, indexes are built at the end")
+            insert_batch = self._insert_staging_batch if bulk_load else self._insert_batch
+            
+            record_dictionary = self._get_record_dictionary(conn, gz_files) if store_records else None
+            
+            jobs = self._plan_import(conn, gz_files)
+            stats.skipped = len(gz_files) - len(jobs)
+            logger.info(f"Found {len(gz_files)} files, {stats.skipped} already imported, "
+                        f"{len(jobs)} to process with {workers} decode worker(s)")
+            
             conn.execute('BEGIN TRANSACTION')
+            uncommitted = 0
             
-            for gz_file in gz_files:
-                logger.info(f"Processing {gz_file.name}")
+            for job, result in self._decode_files(jobs, workers, record_dictionary):
+                if result.error:
+                    logger.error(f"Error processing file {result.file_name}: {result.error}")
+                stats.add_decoded(result)
                 
-                try:
-                    with gzip.open(gz_file, 'rt', encoding='utf-8') as f:
-                        for line_num, line in enumerate(f, 1):
-                            try:
-                                record = json.loads(line.strip())
-                                
-                                # Extract key fields
-                                doi = record.get('DOI', '')
-                                journal = self._extract_journal(record)
-                                publisher = record.get('publisher', '')
-                                published_date = self._extract_date(record.get('published', {}))
-                                
-                                batch_data.append((
-                                    doi, journal, publisher, published_date
-                                ))
-                                
-                                if len(batch_data) >= batch_size:
-                                    self._insert_batch(conn, batch_data, commit=False)
-                                    total_imported += len(batch_data)
-                                    batch_data = []
-                                    
-                                    if total_imported % 50000 == 0:
-                                        logger.info(f"Imported {total_imported} records so far...")
-                                        conn.commit()  # Commit every 50k records
-                                        conn.execute('BEGIN TRANSACTION')
-                                
-                            except json.JSONDecodeError:
-                                logger.warning(f"Invalid JSON in {gz_file.name}, line {line_num}")
-                            except Exception as e:
-                                logger.error(f"Error processing record in {gz_file.name}, line {line_num}: {e}")
+                write_start = time.perf_counter()
+                rows = job.rows
+                for i in range(0, len(result.papers), batch_size):
+                    batch = result.papers[i:i + batch_size]
+                    insert_batch(conn, batch, commit=False)
+                    if result.records:
+                        self._insert_records(conn, result.records[i:i + batch_size])
+                    rows += len(batch)
+                    uncommitted += len(batch)
+                    if uncommitted >= commit_size:
+                        lines_done = result.line_numbers[i + len(batch) - 1]
+                        self._record_progress(conn, job, rows, lines_done, completed=False)
+                        conn.commit()
+                        self.invalidate_cache()
+                        conn.execute('BEGIN TRANSACTION')
+                        uncommitted = 0
                 
-                except Exception as e:
-                    logger.error(f"Error processing file {gz_file.name}: {e}")
-            
-            if batch_data:
-                self._insert_batch(conn, batch_data, commit=False)
-                total_imported += len(batch_data)
+                if result.error:
+                    # Keep what was read, but leave the file unfinished so a rerun retries the rest
+                    lines_done = result.line_numbers[-1] if result.line_numbers else job.start_line
+                    self._record_progress(conn, job, rows, lines_done, completed=False)
+                else:
+                    self._record_progress(conn, job, rows, result.lines, completed=True)
+                stats.add_written(len(result.papers), time.perf_counter() - write_start)
+                
+                if stats.should_report():
+                    logger.info(stats.report())
             
+            write_start = time.perf_counter()
             conn.commit()
+            self.invalidate_cache()
+            stats.add_written(0, time.perf_counter() - write_start)
+            logger.info(stats.report())
+            
+            if bulk_load:
+                self._merge_staging(conn)
         
-        logger.info(f"Import complete! Total records imported: {total_imported}")
+        logger.info(f"Import complete! Total records imported: {stats.written}")
+    
+    def _merge_staging(self, conn):
+        """
+        Move papers_staging into papers, keeping the last occurrence of each DOI.
+        
+        Rows are inserted in DOI order, so the DOI unique index is built by appending
+        rather than by random inserts, and the secondary indexes are created once
+        afterwards. Everything happens in one transaction: if it is interrupted, the
+        staging table is left as it was and a rerun merges it again.
+        """
+        start = time.perf_counter()
+        # Sorting hundreds of millions of rows does not fit in memory
+        conn.execute('PRAGMA temp_store = FILE')
+        conn.execute('BEGIN TRANSACTION')
+        for index_name, _ in SECONDARY_INDEXES:
+            conn.execute(f'DROP INDEX IF EXISTS {index_name}')
+        # With max(), SQLite takes the bare columns from the row holding the maximum,
+        # i.e. the most recently loaded record of each DOI
+        conn.execute('''
+            INSERT INTO papers (doi, journal, publisher, published_date, doi_key)
+            SELECT doi, journal, publisher, published_date, doi_key
+            FROM (
+                SELECT doi, journal, publisher, published_date, doi_key, max(rowid)
+                FROM papers_staging
+                GROUP BY doi
+            )
+            ORDER BY doi
+        ''')
+        papers = conn.execute('SELECT COUNT(*) FROM papers').fetchone()[0]
+        logger.info(f"Copied {papers} unique DOIs into papers in {time.perf_counter() - start:.0f}s, building indexes...")
+        self._create_secondary_indexes(conn)
+        self.doi_keys = True
+        conn.execute('DROP TABLE papers_staging')
+        conn.commit()
+        self.invalidate_cache()
+        conn.execute('PRAGMA temp_store = MEMORY')
+        logger.info(f"Bulk load finished in {time.perf_counter() - start:.0f}s")
+    
+    def _plan_import(self, conn, gz_files: List[Path]) -> List[ImportJob]:
+        """
+        Compare the files with import_progress and return the ones left to import.
+        
+        A file whose size or mtime changed since it was recorded is imported again from the start.
+        """
+        progress = {
+            row['file_name']: row
+            for row in conn.execute('SELECT * FROM import_progress')
+        }
+        jobs = []
+        for gz_file in gz_files:
+            file_stat = gz_file.stat()
+            job = ImportJob(gz_file, file_stat.st_size, file_stat.st_mtime)
+            entry = progress.get(gz_file.name)
+            if entry is not None:
+                if entry['file_size'] != job.file_size or entry['file_mtime'] != job.file_mtime:
+                    logger.info(f"{gz_file.name} changed since it was imported, importing it again")
+                elif entry['completed_at'] is not None:
+                    continue
+                else:
+                    logger.info(f"Resuming {gz_file.name} after line {entry['lines_done']}")
+                    job.start_line = entry['lines_done']
+                    job.rows = entry['rows']
+            jobs.append(job)
+        return jobs
+    
+    def _record_progress(self, conn, job: ImportJob, rows: int, lines_done: int, completed: bool):
+        """Record the progress of a file in import_progress, as part of the current transaction"""
+        conn.execute('''
+            INSERT OR REPLACE INTO import_progress (
+                file_name, file_size, file_mtime, rows, lines_done, completed_at, updated_at
+            ) VALUES (?, ?, ?, ?, ?, CASE WHEN ? THEN CURRENT_TIMESTAMP END, CURRENT_TIMESTAMP)
+        ''', (job.path.name, job.file_size, job.file_mtime, rows, lines_done, completed))
+    
+    def get_import_progress(self) -> Dict:
+        """Summary of the import_progress ledger"""
+        with self.get_connection() as conn:
+            completed, rows = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(rows), 0) FROM import_progress WHERE completed_at IS NOT NULL'
+            ).fetchone()
+            in_progress = [
+                {'file_name': row['file_name'], 'lines_done': row['lines_done'], 'rows': row['rows']}
+                for row in conn.execute('SELECT * FROM import_progress WHERE completed_at IS NULL')
+            ]
+            return {
+                'completed_files': completed,
+                'completed_rows': rows,
+                'in_progress': in_progress,
+            }
+    
+    def _get_record_dictionary(self, conn, gz_files: List[Path]) -> Tuple[int, bytes]:
+        """
+        The (id, dictionary) records are compressed with, trained on a sample of the
+        files the first time records are stored
+        """
+        require_zstandard()
+        for statement in RECORD_SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+        self.has_records = True
+        row = conn.execute('SELECT id, dictionary FROM record_dictionaries ORDER BY id DESC LIMIT 1').fetchone()
+        if row is not None:
+            return row['id'], row['dictionary']
+        
+        logger.info("Training the record compression dictionary...")
+        start = time.perf_counter()
+        dictionary, samples = train_dictionary(gz_files)
+        cursor = conn.execute(
+            'INSERT INTO record_dictionaries (dictionary, samples) VALUES (?, ?)', (dictionary, samples)
+        )
+        conn.commit()
+        logger.info(f"Trained a {len(dictionary)} byte dictionary on {samples} records "
+                    f"in {time.perf_counter() - start:.0f}s")
+        return cursor.lastrowid, dictionary
+    
+    def _insert_records(self, conn, records):
+        """Store compressed records, replacing the record of a DOI imported before"""
+        conn.executemany('''
+            INSERT OR REPLACE INTO paper_records (doi, dictionary_id, record) VALUES (?, ?, ?)
+        ''', records)
+    
+    def _decode_files(self, jobs: List[ImportJob], workers: int, record_dictionary: Optional[Tuple[int, bytes]] = None):
+        """
+        Yield (job, DecodedFile) for every job, in file order.
+        
+        At most ``2 * workers`` files are decoded ahead of the writer, which bounds
+        the memory held by results waiting to be inserted.
+        """
+        if workers <= 1:
+            for job in jobs:
+                yield job, decode_jsonl_file(job.path, job.start_line, record_dictionary)
+            return
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            remaining = iter(jobs)
+            for job in islice(remaining, 2 * workers):
+                pending.append((job, executor.submit(decode_jsonl_file, job.path, job.start_line, record_dictionary)))
+            while pending:
+                job, future = pending.popleft()
+                result = future.result()
+                for next_job in islice(remaining, 1):
+                    pending.append((next_job, executor.submit(decode_jsonl_file, next_job.path, next_job.start_line,
+                                                              record_dictionary)))
+                yield job, result
     
     def _insert_batch(self, conn, batch_data, commit=True):
         """Insert a batch of records into database"""
         conn.executemany('''
             INSERT OR REPLACE INTO papers (
-                doi, journal, publisher,published_date
-            ) VALUES (?, ?, ?, ?)
+                doi, journal, publisher,published_date, doi_key
+            ) VALUES (?, ?, ?, ?, ?)
+        ''', batch_data)
+        if commit:
+            conn.commit()
+    
+    def _insert_staging_batch(self, conn, batch_data, commit=True):
+        """Append a batch of records to the bulk-load staging table"""
+        conn.executemany('''
+            INSERT INTO papers_staging (
+                doi, journal, publisher, published_date, doi_key
+            ) VALUES (?, ?, ?, ?, ?)
         ''', batch_data)
         if commit:
             conn.commit()
     
-    def _extract_journal(self, record: Dict) -> str:
+    @staticmethod
+    def _extract_journal(record: Dict) -> str:
         """Extract journal name from record"""
         journal = record.get('container-title', [])
         if isinstance(journal, list) and journal:
             return journal[0]
         return str(journal) if journal else ''
     
-    def _extract_date(self, date_obj: Dict) -> str:
+    @staticmethod
+    def _extract_date(date_obj: Dict) -> str:
         """Extract date string from Crossref date object"""
         if not date_obj:
             return ''
@@ -177,31 +719,201 @@ class CrossrefDB:
         
         return ''
     
-    def get_paper_by_doi(self, doi: str) -> Optional[Dict]:
+    def get_paper_by_doi(self, doi: str, fields: Optional[List[str]] = None) -> Optional[Dict]:
         """
         Get a paper by DOI (primary lookup method)
         
         Args:
-            doi: The DOI to search for (e.g., "10.1006/jmcc.2000.1342")
+            doi: The DOI to search for (e.g., "10.1006/jmcc.2000.1342"), in any case and
+                 optionally with a resolver prefix (e.g., "https://doi.org/10.1006/JMCC.2000.1342")
+            fields: Top-level fields of the stored Crossref record to add under 'record'
+                    (e.g., ["title", "ISSN"]); needs a database imported with store_records=True
             
         Returns:
             Paper data if found, None otherwise
         """
-        with self.get_connection() as conn:
+        paper = self._get_paper(doi)
+        if paper is not None and fields:
+            self._add_record_fields([paper], fields)
+        return paper
+    
+    def _get_paper(self, doi: str) -> Optional[Dict]:
+        """Look up one paper, from the lookup cache or the database"""
+        key = self._lookup_key(doi)
+        if self.lookup_cache is not None:
+            self._check_for_writes()
+            hit, paper = self.lookup_cache.get(key)
+            if hit:
+                # Copy so callers can't modify the cached entry
+                return dict(paper) if paper else None
+        
+        conn = self.get_read_connection()
+        if self.compact:
             result = conn.execute(
-                'SELECT * FROM papers WHERE doi = ?', (doi,)
+                COMPACT_PAPERS_SELECT + 'WHERE p.doi = ?', (key,)
             ).fetchone()
-            return dict(result) if result else None
+            paper = compact_row_to_paper(result) if result else None
+        else:
+            result = conn.execute(
+                f'SELECT * FROM papers WHERE {self._key_column} = ? LIMIT 1', (key,)
+            ).fetchone()
+            paper = dict(result) if result else None
+        
+        if self.lookup_cache is not None:
+            self.lookup_cache.put(key, paper)
+            return dict(paper) if paper else None
+        return paper
+    
+    def _lookup_key(self, doi: str) -> str:
+        """The value looked up for a DOI: its canonical key, or the DOI as given in databases without keys"""
+        return normalize_doi(doi) if self.doi_keys else doi
     
-    def search_by_doi(self, doi: str) -> Optional[Dict]:
+    @property
+    def _key_column(self) -> str:
+        """Column of the standard papers table that _lookup_key values are matched against"""
+        return 'doi_key' if self.doi_keys else 'doi'
+    
+    def iter_papers_by_dois(self, dois: Iterable[str], chunk_size: int = 500,
+                            fields: Optional[List[str]] = None) -> Iterator[Tuple[str, Optional[Dict]]]:
+        """
+        Look up many DOIs, yielding (doi, paper) pairs in input order with None for misses
+        
+        DOIs are resolved ``chunk_size`` at a time with one ``IN`` query per chunk
+        (kept well below SQLite's limit on bound parameters). Duplicate DOIs are
+        only looked up and yielded once. Each chunk is fully fetched before it is
+        yielded, so a consumer can pause between chunks.
+        
+        Args:
+            dois: DOIs to look up, written as for get_paper_by_doi; each is yielded as given
+            chunk_size: Number of DOIs per query
+            fields: Stored record fields to add to each paper, as for get_paper_by_doi
+        """
+        seen = set()
+        chunk = []
+        for doi in dois:
+            if doi in seen:
+                continue
+            seen.add(doi)
+            chunk.append(doi)
+            if len(chunk) >= chunk_size:
+                yield from self._lookup_chunk(chunk, fields)
+                chunk = []
+        if chunk:
+            yield from self._lookup_chunk(chunk, fields)
+    
+    def get_papers_by_dois(self, dois: Iterable[str], chunk_size: int = 500,
+                           fields: Optional[List[str]] = None) -> Dict[str, Optional[Dict]]:
+        """
+        Get many papers at once
+        
+        Returns:
+            Dict keyed by every requested DOI, with the paper data or None if it is not in the database
+        """
+        return dict(self.iter_papers_by_dois(dois, chunk_size, fields))
+    
+    def _lookup_chunk(self, dois: List[str], fields: Optional[List[str]] = None) -> List[Tuple[str, Optional[Dict]]]:
+        """Resolve one chunk of unique DOIs, from the lookup cache or with a single IN query"""
+        keys = {doi: self._lookup_key(doi) for doi in dois}
+        results = {}
+        uncached = list(dict.fromkeys(keys.values()))
+        if self.lookup_cache is not None:
+            self._check_for_writes()
+            uncached = []
+            for key in dict.fromkeys(keys.values()):
+                hit, paper = self.lookup_cache.get(key)
+                if hit:
+                    results[key] = paper
+                else:
+                    uncached.append(key)
+        
+        if uncached:
+            conn = self.get_read_connection()
+            placeholders = ','.join('?' * len(uncached))
+            if self.compact:
+                rows = conn.execute(
+                    COMPACT_PAPERS_SELECT + f'WHERE p.doi IN ({placeholders})', uncached
+                ).fetchall()
+                found = {row['doi']: compact_row_to_paper(row) for row in rows}
+            else:
+                key_column = self._key_column
+                rows = conn.execute(
+                    f'SELECT * FROM papers WHERE {key_column} IN ({placeholders})', uncached
+                ).fetchall()
+                found = {row[key_column]: dict(row) for row in rows}
+            for key in uncached:
+                results[key] = found.get(key)
+                if self.lookup_cache is not None:
+                    self.lookup_cache.put(key, results[key])
+        
+        # Copies, so callers can't modify cached entries or each other's results
+        papers = [(doi, dict(results[key]) if results[key] else None) for doi, key in keys.items()]
+        if fields:
+            self._add_record_fields([paper for _, paper in papers if paper is not None], fields)
+        return papers
+    
+    def get_record(self, doi: str) -> Optional[Dict]:
+        """The full stored Crossref record of a paper, or None if the paper or its record isn't stored"""
+        paper = self._get_paper(doi)
+        if paper is None:
+            return None
+        return self._load_records([paper['doi']]).get(paper['doi'])
+    
+    def _add_record_fields(self, papers: List[Dict], fields: List[str]):
+        """
+        Set 'record' on each paper to the requested fields of its stored record (None without one)
+        
+        Records are only read and decompressed here, so lookups without fields never pay for them
+        and the lookup cache only holds the small extracted fields.
+        """
+        if not self.has_records:
+            raise ValueError(f"{self.db_path} has no stored records; import with store_records=True")
+        records = self._load_records(list(dict.fromkeys(paper['doi'] for paper in papers)))
+        for paper in papers:
+            record = records.get(paper['doi'])
+            paper['record'] = select_fields(record, fields) if record is not None else None
+    
+    def _load_records(self, dois: List[str], chunk_size: int = 500) -> Dict[str, Dict]:
+        """Read and decompress the stored records of papers, keyed by their papers.doi"""
+        if not self.has_records or not dois:
+            return {}
+        conn = self.get_read_connection()
+        records = {}
+        for i in range(0, len(dois), chunk_size):
+            chunk = dois[i:i + chunk_size]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f'SELECT doi, dictionary_id, record FROM paper_records WHERE doi IN ({placeholders})', chunk
+            )
+            for row in rows:
+                decompressor = self._get_decompressor(conn, row['dictionary_id'])
+                records[row['doi']] = json.loads(decompressor.decompress(row['record']))
+        return records
+    
+    def _get_decompressor(self, conn, dictionary_id: int):
+        """Decompressor for a record dictionary, kept per thread like the read connection"""
+        decompressors = getattr(self._local, 'decompressors', None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+        decompressor = decompressors.get(dictionary_id)
+        if decompressor is None:
+            row = conn.execute(
+                'SELECT dictionary FROM record_dictionaries WHERE id = ?', (dictionary_id,)
+            ).fetchone()
+            decompressor = decompressors[dictionary_id] = make_decompressor(row['dictionary'])
+        return decompressor
+    
+    def search_by_doi(self, doi: str, fields: Optional[List[str]] = None) -> Optional[Dict]:
         """Search for paper by DOI (alias for get_paper_by_doi)"""
-        return self.get_paper_by_doi(doi)
+        return self.get_paper_by_doi(doi, fields)
     
     def get_stats(self) -> Dict:
         """Get database statistics"""
-        with self.get_connection() as conn:
-            total_papers = conn.execute('SELECT COUNT(*) FROM papers').fetchone()[0]
-            
+        conn = self.get_read_connection()
+        total_papers = conn.execute('SELECT COUNT(*) FROM papers').fetchone()[0]
+        
+        if self.compact:
+            top_publishers = conn.execute(COMPACT_TOP_PUBLISHERS_QUERY).fetchall()
+        else:
             top_publishers = conn.execute('''
                 SELECT publisher, COUNT(*) as count 
                 FROM papers 
@@ -210,11 +922,11 @@ class CrossrefDB:
                 ORDER BY count DESC 
                 LIMIT 10
             ''').fetchall()
-            
-            return {
-                'total_papers': total_papers,
-                'top_publishers': [{'publisher': row[0], 'count': row[1]} for row in top_publishers],
-            }
+        
+        return {
+            'total_papers': total_papers,
+            'top_publishers': [{'publisher': row[0], 'count': row[1]} for row in top_publishers],
+        }
 
 def main():
     """Example usage of the CrossrefDB class"""
@@ -226,18 +938,38 @@ def main():
     
     DB_PATH = f"{EXTERNAL_DRIVE_PATH}/crossref-api.db"
     DATA_DIRECTORY = "/Volumes/Storage/crossref/data"  # Directory with .jsonl.gz files
+    STORE_RECORDS = False  # Also keep full records for fields= lookups (needs zstandard)
     
     db = CrossrefDB(DB_PATH)
     
-    # Check if database is empty and needs import
+    # Start or resume the import; files already recorded in import_progress are skipped
     stats = db.get_stats()
+    if db.compact:
+        print(f"Compact database contains {stats['total_papers']} papers (read-only)")
+        return
+    progress = db.get_import_progress()
+    if stats['total_papers'] > 0 and progress['completed_files'] == 0 and not progress['in_progress']:
+        # Imported before progress was tracked, nothing to resume from
+        print(f"Database contains {stats['total_papers']} papers")
+        if not db.doi_keys:
+            print("Adding canonical DOI keys...")
+            db.add_doi_keys()
+        return
+    
     if stats['total_papers'] == 0:
         print("Database is empty. Starting import...")
         print("This may take several hours...")
-        print("Using optimized batch size of 10,000 records for faster imports...")
-        db.import_jsonl_files(DATA_DIRECTORY, batch_size=10000)
     else:
-        print(f"Database contains {stats['total_papers']} papers")
+        print(f"Database contains {stats['total_papers']} papers from {progress['completed_files']} imported files. "
+              f"Resuming import...")
+        for entry in progress['in_progress']:
+            print(f"  {entry['file_name']}: continuing after line {entry['lines_done']}")
+    print("Using optimized batch size of 10,000 records for faster imports...")
+    db.import_jsonl_files(DATA_DIRECTORY, batch_size=10000, store_records=STORE_RECORDS)
+    
+    if not db.doi_keys:
+        print("Adding canonical DOI keys to papers imported before they existed...")
+        db.add_doi_keys()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Optional storage of the full Crossref records, zstd-compressed with a trained dictionary
+
+With ``import_jsonl_files(..., store_records=True)`` every record is kept next to
+the extracted fields, so metadata such as titles, ISSNs, funders or references can
+be served locally instead of from the live Crossref API. Records are small and
+very similar to each other, so they are compressed one by one with a zstd
+dictionary trained on a sample of the dump, which compresses them far better than
+zstd alone. Records are only decompressed when a lookup asks for extra fields.
+
+Needs the optional zstandard package (pip install zstandard).
+"""
+
+import gzip
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RECORD_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS record_dictionaries (
+        id INTEGER PRIMARY KEY,
+        dictionary BLOB NOT NULL,
+        samples INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    # Keyed by papers.doi, so INSERT OR REPLACE keeps the record of the same
+    # occurrence of a DOI as the papers row
+    '''
+    CREATE TABLE IF NOT EXISTS paper_records (
+        doi TEXT PRIMARY KEY,
+        dictionary_id INTEGER NOT NULL REFERENCES record_dictionaries(id),
+        record BLOB NOT NULL
+    )
+    ''',
+]
+
+DICTIONARY_SIZE = 112640  # bytes, zstd's default dictionary size
+DICTIONARY_SAMPLES = 50000  # records used to train the dictionary
+DICTIONARY_SAMPLE_FILES = 20  # spread over this many files of the dump
+COMPRESSION_LEVEL = 9
+
+
+def require_zstandard():
+    if zstandard is None:
+        raise ImportError("Storing records requires the 'zstandard' package (pip install zstandard)")
+
+
+def train_dictionary(gz_files: List[Path], samples: int = DICTIONARY_SAMPLES,
+                     dict_size: int = DICTIONARY_SIZE) -> Tuple[bytes, int]:
+    """
+    Train a zstd dictionary on records sampled from files spread over the dump
+
+    Returns:
+        (dictionary bytes, number of records it was trained on)
+    """
+    require_zstandard()
+    step = max(1, len(gz_files) // DICTIONARY_SAMPLE_FILES)
+    sample_files = gz_files[::step][:DICTIONARY_SAMPLE_FILES]
+    per_file = max(1, samples // len(sample_files))
+    sample_records = []
+    for gz_file in sample_files:
+        with gzip.open(gz_file, 'rb') as f:
+            for line_num, line in enumerate(f):
+                if line_num >= per_file:
+                    break
+                line = line.strip()
+                if line:
+                    sample_records.append(line)
+    dictionary = zstandard.train_dictionary(dict_size, sample_records)
+    return dictionary.as_bytes(), len(sample_records)
+
+
+def make_compressor(dictionary: bytes, level: int = COMPRESSION_LEVEL):
+    """Compressor for single records; the dictionary ID is left out of each frame, paper_records has it"""
+    require_zstandard()
+    return zstandard.ZstdCompressor(
+        level=level,
+        dict_data=zstandard.ZstdCompressionDict(dictionary),
+        write_dict_id=False,
+        write_content_size=True,
+        write_checksum=False,
+    )
+
+
+def make_decompressor(dictionary: bytes):
+    require_zstandard()
+    return zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(dictionary))
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Split a comma-separated fields= selector ("title,ISSN") into field names"""
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    return names or None
+
+
+def select_fields(record: Dict, fields: Iterable[str]) -> Dict[str, Any]:
+    """The requested top-level fields of a record, with None for fields the record doesn't have"""
+    return {name: record.get(name) for name in fields}
@@ -2,13 +2,43 @@
 """
 Simple FastAPI web service for querying Crossref database
 Run with: uvicorn crossref_web_api:app --reload
+
+SQLite calls are blocking, so the handlers run them on a bounded thread pool
+(CROSSREF_API_DB_WORKERS threads, default 16) and the event loop stays free to
+accept requests while queries run. At most that many queries run at once; the
+rest wait in the pool's queue.
+
+With a database imported with store_records=True, ?fields=title,ISSN adds those
+fields of the full Crossref record to each paper, under "record".
 """
 
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional
+
 from fastapi import FastAPI, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from crossref_importer import CrossrefDB
+from crossref_records import parse_fields
 from pydantic import BaseModel
 
-DB_PATH = "/Volumes/Storage/crossref/crossref-api.db"
+DB_PATH = os.getenv("CROSSREF_DB_PATH", "/Volumes/Storage/crossref/crossref-api.db")
+
+# Number of threads running database queries, i.e. the number of concurrent queries
+DB_WORKERS = int(os.getenv("CROSSREF_API_DB_WORKERS", "16"))
+
+# In-memory cache of DOI lookups, including DOIs that were not found (0 disables it)
+CACHE_SIZE = int(os.getenv("CROSSREF_API_CACHE_SIZE", str(CrossrefDB.LOOKUP_CACHE_SIZE)))
+CACHE_TTL = float(os.getenv("CROSSREF_API_CACHE_TTL", str(CrossrefDB.LOOKUP_CACHE_TTL)))
+
+# Largest number of DOIs accepted by one POST /papers request
+MAX_BATCH_DOIS = 50000
+# DOIs resolved per database call when streaming NDJSON
+STREAM_CHUNK_SIZE = 500
 
 app = FastAPI(
     title="Simple Crossref API",
@@ -16,52 +46,147 @@ app = FastAPI(
     version="1.0.0"
 )
 
-db = CrossrefDB(DB_PATH)
+# Lookups reuse one read-only connection per worker thread (see CrossrefDB.get_read_connection)
+db = CrossrefDB(DB_PATH, lookup_cache_size=CACHE_SIZE, lookup_cache_ttl=CACHE_TTL)
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="crossref-db")
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking database call on the database thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, partial(func, *args, **kwargs))
+
 
 class PaperResponse(BaseModel):
     doi: str
     published_date: str
     publisher: str
     journal: str
+    # Only set, and only included in responses, when fields are requested
+    record: Optional[Dict[str, Any]] = None
 
 
-@app.get("/paper/{doi:path}", response_model=PaperResponse)
-async def get_paper(doi: str):
+class PapersRequest(BaseModel):
+    dois: List[str]
+
+
+class PapersResponse(BaseModel):
+    found: int
+    missing: List[str]
+    papers: Dict[str, Optional[PaperResponse]]
+
+
+def to_paper_response(result: Dict) -> PaperResponse:
+    """Build the response fields from a papers row"""
+    fields = dict(
+        doi=result.get('doi', ''),
+        published_date=result.get('published_date', ''),
+        publisher=result.get('publisher', ''),
+        journal=result.get('journal', '')
+    )
+    if 'record' in result:
+        fields['record'] = result['record']
+    return PaperResponse(**fields)
+
+
+def record_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Parse the fields= selector, rejecting it if the database has no stored records"""
+    names = parse_fields(fields)
+    if names and not db.has_records:
+        raise HTTPException(status_code=400, detail="This database has no stored records to select fields from")
+    return names
+
+
+@app.get("/paper/{doi:path}", response_model=PaperResponse, response_model_exclude_unset=True)
+async def get_paper(doi: str, fields: Optional[str] = None):
     """
     Get paper information by DOI
     
     Args:
-        doi: The DOI to fetch (e.g., "10.1042/bj20130269")
+        doi: The DOI to fetch (e.g., "10.1042/bj20130269"), in any case and optionally
+             with a resolver prefix (e.g., "https://doi.org/10.1042/BJ20130269")
+        fields: Comma-separated fields of the stored Crossref record to include (e.g., "title,ISSN")
     
     Returns:
-        Paper information with doi, published_date, publisher, and journal
+        Paper information with doi, published_date, publisher, and journal, plus
+        ``record`` with the requested fields (null if the paper has no stored record)
     """
+    names = record_fields(fields)
     try:
-        result = db.search_by_doi(doi)
+        result = await run_db(db.search_by_doi, doi, names)
         if not result:
             raise HTTPException(status_code=404, detail="Paper not found")
         
-        response = PaperResponse(
-            doi=result.get('doi', ''),
-            published_date=result.get('published_date', ''),
-            publisher=result.get('publisher', ''),
-            journal=result.get('journal', '')
-        )
-        
-        return response
+        return to_paper_response(result)
         
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+@app.post("/papers", response_model=PapersResponse, response_model_exclude_unset=True)
+async def get_papers(request: PapersRequest, stream: bool = False, fields: Optional[str] = None):
+    """
+    Get paper information for many DOIs in one request
+    
+    Args:
+        request: {"dois": [...]}, up to MAX_BATCH_DOIS DOIs
+        stream: Return NDJSON, one line per DOI as it is resolved, instead of a single JSON object
+        fields: Comma-separated fields of the stored Crossref record to include, as for GET /paper
+    
+    Returns:
+        Every requested DOI keyed to its paper information, or null if it is not in the
+        database; misses are also listed in ``missing``. When streaming, each line is
+        {"doi": ..., "found": true, "paper": {...}} or {"doi": ..., "found": false}.
+    """
+    if len(request.dois) > MAX_BATCH_DOIS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_DOIS} DOIs per request")
+    names = record_fields(fields)
+    
+    if stream:
+        async def ndjson_lines():
+            unique_dois = list(dict.fromkeys(request.dois))
+            # One pool task per chunk, so a large batch can't hold a database thread for its whole length
+            for i in range(0, len(unique_dois), STREAM_CHUNK_SIZE):
+                results = await run_db(db.get_papers_by_dois, unique_dois[i:i + STREAM_CHUNK_SIZE], fields=names)
+                lines = []
+                for doi, result in results.items():
+                    if result:
+                        line = {"doi": doi, "found": True, "paper": jsonable_encoder(to_paper_response(result), exclude_unset=True)}
+                    else:
+                        line = {"doi": doi, "found": False}
+                    lines.append(json.dumps(line) + "\n")
+                yield "".join(lines)
+        
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+    
+    try:
+        results = await run_db(db.get_papers_by_dois, request.dois, fields=names)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    
+    papers = {doi: to_paper_response(result) if result else None for doi, result in results.items()}
+    missing = [doi for doi, paper in papers.items() if paper is None]
+    return PapersResponse(found=len(papers) - len(missing), missing=missing, papers=papers)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     try:
         # Simple database connectivity check
-        with db.get_connection() as conn:
-            conn.execute("SELECT COUNT(*) FROM papers").fetchone()
+        await run_db(lambda: db.get_read_connection().execute("SELECT 1 FROM papers LIMIT 1").fetchone())
         return {"status": "healthy"}
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Database unhealthy: {str(e)}")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Lookup cache counters: size, hits (and hits on cached misses), misses, evictions, expirations, invalidations"""
+    return db.cache_stats()
+
+@app.on_event("shutdown")
+def close_database():
+    """Stop the database thread pool and close the pooled read-only connections"""
+    db_executor.shutdown(wait=True)
+    db.close()
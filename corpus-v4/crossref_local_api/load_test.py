@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Load test for the Crossref web API
+Fires GET /paper/{doi} requests from many concurrent clients and reports latency percentiles
+
+Usage:
+    python load_test.py --db /Volumes/Storage/crossref/crossref-api.db --concurrency 200 --requests 20000
+    python load_test.py --dois-file dois.txt --url http://localhost:8000
+"""
+
+import argparse
+import random
+import sqlite3
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+
+
+def load_dois(args) -> list:
+    """DOIs to request: one per line from --dois-file, or a random sample of --db"""
+    if args.dois_file:
+        with open(args.dois_file, 'r', encoding='utf-8') as f:
+            dois = [line.strip() for line in f if line.strip()]
+    else:
+        conn = sqlite3.connect(f'file:{args.db}?mode=ro', uri=True)
+        try:
+            dois = [row[0] for row in conn.execute(
+                'SELECT doi FROM papers ORDER BY random() LIMIT ?', (args.sample,)
+            )]
+        finally:
+            conn.close()
+    if not dois:
+        raise SystemExit("No DOIs to request")
+    return dois
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_load_test(url: str, dois: list, concurrency: int, total_requests: int, miss_ratio: float, timeout: float):
+    """Send ``total_requests`` lookups from ``concurrency`` clients and return (latencies, status counts, seconds)"""
+    local = threading.local()
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def one_request(i):
+        # One keep-alive session per client thread
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        doi = random.choice(dois)
+        if random.random() < miss_ratio:
+            doi = f"10.0000/load-test-miss-{i}"
+        start = time.perf_counter()
+        try:
+            status = session.get(f"{url}/paper/{quote(doi, safe='/')}", timeout=timeout).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one_request, range(total_requests)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test GET /paper/{doi} with concurrent clients")
+    parser.add_argument('--url', default='http://localhost:8000', help="Base URL of the API")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--db', help="Sample DOIs from this SQLite database")
+    source.add_argument('--dois-file', help="File with one DOI per line")
+    parser.add_argument('--sample', type=int, default=10000, help="Number of DOIs to sample from --db")
+    parser.add_argument('--concurrency', type=int, default=100, help="Number of concurrent clients")
+    parser.add_argument('--requests', type=int, default=10000, help="Total number of requests")
+    parser.add_argument('--miss-ratio', type=float, default=0.0, help="Fraction of requests for unknown DOIs")
+    parser.add_argument('--timeout', type=float, default=30.0, help="Request timeout in seconds")
+    args = parser.parse_args()
+
+    dois = load_dois(args)
+    print(f"Sending {args.requests} requests from {args.concurrency} clients to {args.url} "
+          f"({len(dois)} distinct DOIs, {args.miss_ratio:.0%} misses)")
+    latencies, statuses, elapsed = run_load_test(
+        args.url.rstrip('/'), dois, args.concurrency, args.requests, args.miss_ratio, args.timeout
+    )
+
+    latencies.sort()
+    print(f"\nCompleted in {elapsed:.1f}s, {len(latencies) / elapsed:,.0f} requests/s")
+    print("Status codes: " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+    print("Latency (ms):")
+    print(f"  mean {statistics.mean(latencies) * 1000:.1f}")
+    for pct in (50, 90, 95, 99, 99.9):
+        print(f"  p{pct:<5} {percentile(latencies, pct) * 1000:.1f}")
+    print(f"  max    {latencies[-1] * 1000:.1f}")
+
+
+if __name__ == "__main__":
+    main()
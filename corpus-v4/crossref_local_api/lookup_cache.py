@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Bounded in-process LRU cache with TTL for DOI lookups
+Caches misses as well as hits, so repeated lookups of unknown DOIs don't reach SQLite either
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+
+class LookupCache:
+    """Thread-safe LRU cache whose entries also expire ``ttl`` seconds after they were stored"""
+
+    def __init__(self, max_size: int = 100000, ttl: float = 3600.0):
+        """
+        Args:
+            max_size: Maximum number of entries; the least recently used entry is evicted beyond it
+            ttl: Seconds an entry stays valid (0 or less keeps entries until they are evicted)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Look up a key
+
+        Returns:
+            (True, value) on a hit, where value may be None for a cached miss; (False, None) otherwise
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            stored_at, value = entry
+            if self.ttl > 0 and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if value is None:
+                self.negative_hits += 1
+            return True, value
+
+    def put(self, key: str, value: Any):
+        """Store a value (None records that the key does not exist)"""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry, e.g. after the underlying data changed"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict:
+        """Counters since the cache was created"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
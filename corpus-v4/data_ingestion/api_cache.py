@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Persistent cache of API lookups (PMCID -> DOI from EuropePMC, dataset DOI ->
+publisher from DataCite), stored in SQLite in WAL mode.
+
+Entries live in namespaces, one per upstream API. An entry can be negative
+(the API answered, but had nothing for the key), so the key isn't requested
+again on every run. Entries can expire: each namespace has a TTL for found
+values and one for negative entries. Writes are committed every
+``commit_every`` entries, so an interrupted run keeps nearly everything it
+fetched.
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+
+class ApiCache:
+    """Key-value cache of API responses in an SQLite file."""
+
+    def __init__(self, path, commit_every=500, read_only=False):
+        self.path = path
+        self.commit_every = commit_every
+        self.ttls = {}  # namespace -> (ttl, negative_ttl) in seconds, None never expires
+        self.pending = 0
+        if read_only:
+            # For worker processes reading a cache that another process writes
+            self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=30.0)
+            return
+        self.conn = sqlite3.connect(path, timeout=30.0)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS api_cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID
+        ''')
+        self.conn.commit()
+
+    def set_ttl(self, namespace, ttl=None, negative_ttl=None):
+        """Expire found values after ``ttl`` and negative entries after ``negative_ttl`` seconds."""
+        self.ttls[namespace] = (ttl, negative_ttl)
+
+    def lookup(self, namespace, key):
+        """Returns (True, value) for a cached key, value None for a negative entry; (False, None) otherwise."""
+        row = self.conn.execute(
+            'SELECT value, fetched_at FROM api_cache WHERE namespace = ? AND key = ?', (namespace, key)
+        ).fetchone()
+        if row is None:
+            return False, None
+        value, fetched_at = row
+        ttl, negative_ttl = self.ttls.get(namespace, (None, None))
+        ttl = negative_ttl if value is None else ttl
+        if ttl is not None and time.time() - fetched_at > ttl:
+            return False, None
+        return True, value
+
+    def put(self, namespace, key, value):
+        """Cache a value (None for a negative entry), committing every ``commit_every`` writes."""
+        self.conn.execute(
+            'INSERT OR REPLACE INTO api_cache (namespace, key, value, fetched_at) VALUES (?, ?, ?, ?)',
+            (namespace, key, value, time.time())
+        )
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+
+    def put_many(self, namespace, items):
+        """Cache (key, value) pairs and commit them."""
+        now = time.time()
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO api_cache (namespace, key, value, fetched_at) VALUES (?, ?, ?, ?)',
+            ((namespace, key, value, now) for key, value in items)
+        )
+        self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def count(self, namespace):
+        """Number of entries in a namespace, expired ones included."""
+        return self.conn.execute(
+            'SELECT COUNT(*) FROM api_cache WHERE namespace = ?', (namespace,)
+        ).fetchone()[0]
+
+    def import_json(self, namespace, json_file):
+        """
+        Copy a JSON cache file written by earlier versions into an empty namespace.
+        Returns the number of entries imported.
+        """
+        if not os.path.exists(json_file) or self.count(namespace):
+            return 0
+        try:
+            with open(json_file, 'r') as f:
+                entries = json.load(f)
+        except Exception as e:
+            print(f"Error loading {json_file}: {e}")
+            return 0
+        self.put_many(namespace, entries.items())
+        return len(entries)
+
+    def namespace(self, namespace):
+        """Dict-like view of one namespace."""
+        return CacheNamespace(self, namespace)
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+class CacheNamespace:
+    """
+    One namespace of an ApiCache, usable like the dicts the cache replaced:
+    ``key in view``, ``view.get(key)`` and ``view[key] = value``.
+    """
+
+    def __init__(self, cache, namespace):
+        self.cache = cache
+        self.namespace = namespace
+
+    def __contains__(self, key):
+        return self.cache.lookup(self.namespace, key)[0]
+
+    def lookup(self, key):
+        """(True, value) for a cached key, value None for a negative entry; (False, None) otherwise."""
+        return self.cache.lookup(self.namespace, key)
+
+    def get(self, key, default=None):
+        found, value = self.cache.lookup(self.namespace, key)
+        return value if found and value is not None else default
+
+    def __setitem__(self, key, value):
+        self.cache.put(self.namespace, key, value)
+
+    def update(self, items):
+        self.cache.put_many(self.namespace, dict(items).items())
+
+    def __len__(self):
+        return self.cache.count(self.namespace)
+
+    def commit(self):
+        self.cache.commit()
@@ -1,17 +1,150 @@
 #!/usr/bin/env python3
 
+import argparse
 import os
 import csv
 import glob
 import json
+import random
 import requests
+import sqlite3
+import tempfile
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
 import pandas as pd
 from urllib.parse import urlencode
 
+from api_cache import ApiCache
+
+# EuropePMC search endpoint; override to point the fetcher at a mirror or a local stub server
+EUROPEPMC_SEARCH_URL = os.getenv("EUROPEPMC_SEARCH_URL",
+                                 "https://www.ebi.ac.uk/europepmc/webservices/rest/searchPOST")
+# Batches of PMCIDs in flight at once, and the request rate they share
+EUROPEPMC_CONCURRENCY = int(os.getenv("EUROPEPMC_CONCURRENCY", "4"))
+EUROPEPMC_RATE = float(os.getenv("EUROPEPMC_RATE", "5"))  # requests per second
+EUROPEPMC_PAGE_SIZE = 1000
+
+# DataCite DOI endpoint, used to find the repository (publisher) of datasets cited by DOI
+DATACITE_API_URL = os.getenv("DATACITE_API_URL", "https://api.datacite.org/dois")
+DATACITE_CONCURRENCY = int(os.getenv("DATACITE_CONCURRENCY", "8"))
+DATACITE_RATE = float(os.getenv("DATACITE_RATE", "10"))  # requests per second
+# Files of this repository cite datasets by DOI; their repository is looked up per dataset
+DOI_REPOSITORY = 'doi'
+
+# Namespaces of the API cache, and how long their entries stay valid (None: forever).
+# Negative entries (the API had nothing for the key) are looked up again after a while,
+# since EuropePMC and DataCite keep adding records.
+EUROPEPMC_NAMESPACE = 'europepmc_doi'
+DATACITE_NAMESPACE = 'datacite_publisher'
+CACHE_TTL = None
+CACHE_NEGATIVE_TTL = 30 * 24 * 3600
+
+# Write buffer of each output file in streaming mode
+WRITE_BUFFER_SIZE = 1024 * 1024
+OUTPUT_COLUMNS = ['repository', 'dataset', 'publication']
+
+# Retries of a request that got a 429, a 5xx or a connection error
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0  # seconds, doubled after every failed attempt
+BACKOFF_MAX = 60.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by concurrent requests to one API.
+
+    Allows ``rate`` requests per second on average, with bursts of up to ``capacity``.
+    The rate adapts to the server: it is halved every time the server answers 429
+    and creeps back up to the configured rate with every successful request.
+    """
+
+    def __init__(self, rate, capacity=None, min_rate=0.2):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self):
+        """The server is rate limiting us: halve the rate."""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def speed_up(self):
+        """A request succeeded: recover a little of the configured rate."""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+_thread_local = threading.local()
+
+
+def get_session():
+    """requests session of the calling thread, so each worker reuses its own connections."""
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        session = _thread_local.session = requests.Session()
+    return session
+
+
+def request_with_backoff(method, url, limiter, **kwargs):
+    """
+    Send a request through the rate limiter, retrying 429s, 5xx responses and connection
+    errors with exponential backoff and full jitter (a Retry-After header is honoured).
+
+    Returns the response (of any other status), or None once the retries are used up.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire()
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except requests.RequestException as e:
+            print(f"    Request error ({e}), attempt {attempt + 1}/{MAX_RETRIES + 1}")
+        else:
+            if response.status_code not in RETRY_STATUS_CODES:
+                limiter.speed_up()
+                return response
+            if response.status_code == 429:
+                limiter.slow_down()
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+            print(f"    API returned status code {response.status_code}, attempt {attempt + 1}/{MAX_RETRIES + 1}")
+        if attempt < MAX_RETRIES:
+            time.sleep(delay)
+    return None
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Reformat EuropePMC TextMinedTerms CSVs into repository/dataset/publication CSVs")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Scan all files once for missing PMCIDs, resolve them, then stream each output "
+                             "with flat memory use (instead of reading and buffering each file twice)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Write this many files at once in worker processes (implies --streaming)")
+    args = parser.parse_args()
+    if args.workers > 1:
+        args.streaming = True
+
     print(f"Processing EuropePMC data... {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
     input_dir = "europepmc_raw_data"
@@ -26,30 +159,272 @@ def main():
 
     repository_mappings = load_repository_mappings()
 
-    cache_file = os.path.join(output_dir, "api_cache.json")
-    api_cache = load_api_cache(cache_file)
-    print(f"Loaded API cache with {len(api_cache)} entries")
+    cache = open_api_cache(output_dir)
+    api_cache = cache.namespace(EUROPEPMC_NAMESPACE)
+    print(f"Opened API cache with {len(api_cache)} EuropePMC entries")
 
-    csv_files = glob.glob(os.path.join(input_dir, "*.csv"))
+    csv_files = sorted(glob.glob(os.path.join(input_dir, "*.csv")))
     csv_files = [f for f in csv_files if not f.endswith("PMID_PMCID_DOI.csv")]
 
+    # Files of the "doi" repository need the publisher of every dataset DOI: resolve
+    # them once, across all files, before any file is written
+    doi_repository_files = [
+        f for f in csv_files if get_repository_name(f, repository_mappings)[1] == DOI_REPOSITORY
+    ]
+    repository_publishers = cache.namespace(DATACITE_NAMESPACE)
+
+    if args.streaming:
+        process_streaming(csv_files, output_dir, doi_mappings, repository_mappings, api_cache,
+                          doi_repository_files, repository_publishers, args.workers)
+        print(f"API cache has {len(api_cache)} EuropePMC entries")
+        cache.close()
+        print(f"Processing complete! {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        return
+
+    if doi_repository_files:
+        # Only rows with a publication DOI are written, so resolve the PMCIDs of these
+        # files first and only look up the datasets of rows that will be kept
+        missing_pmcids = set()
+        for csv_file in doi_repository_files:
+            missing_pmcids |= collect_missing_pmcids_for_file(csv_file, doi_mappings, api_cache)
+        if missing_pmcids:
+            print(f"Found {len(missing_pmcids)} missing PMCIDs in \"doi\" repository files, batch fetching DOIs...")
+            batch_fetch_dois(sorted(missing_pmcids), api_cache=api_cache)
+        print(f"DataCite cache has {len(repository_publishers)} entries")
+        resolve_repository_publishers(collect_dataset_dois(doi_repository_files, doi_mappings, api_cache),
+                                      repository_publishers)
+        cache.commit()
+
     for csv_file in csv_files:
         base_name = os.path.basename(csv_file)
-        repo_name = base_name.split('.')[0]
-        standard_repo_name = repository_mappings.get(repo_name, repo_name)
+        repo_name, standard_repo_name = get_repository_name(csv_file, repository_mappings)
 
         print(f"Processing {base_name} (Repository: {standard_repo_name})...")
 
         output_file = os.path.join(output_dir, f"{repo_name}_formatted.csv")
 
-        process_csv_file(csv_file, output_file, doi_mappings, standard_repo_name, api_cache)
+        process_csv_file(csv_file, output_file, doi_mappings, standard_repo_name, api_cache,
+                         repository_publishers)
 
-    save_api_cache(api_cache, os.path.join(output_dir, "api_cache.json"))
-    print(f"Saved API cache with {len(api_cache)} entries")
+    print(f"API cache has {len(api_cache)} EuropePMC entries")
+    cache.close()
     print(f"Processing complete! {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
 
-def process_csv_file(input_file, output_file, doi_mappings, repository_name, api_cache):
+def get_repository_name(csv_file, repository_mappings):
+    """The repository code of an input file (its name up to the first dot) and its standardized name."""
+    repo_name = os.path.basename(csv_file).split('.')[0]
+    return repo_name, repository_mappings.get(repo_name, repo_name)
+
+
+def process_streaming(csv_files, output_dir, doi_mappings, repository_mappings, api_cache,
+                      doi_repository_files, repository_publishers, workers=1):
+    """
+    Streaming mode: one scan over all files collects the PMCIDs without a DOI (and
+    the dataset DOIs of "doi" repository files), which are resolved in bulk; a second
+    streaming pass then writes each output file row by row.
+
+    Only the sets of unresolved keys are held in memory, never the rows of a file.
+    With ``workers`` > 1 the output files are written by a process pool (see
+    write_files_in_parallel).
+    """
+    print("Step 1: Scanning all files for missing PMCIDs...")
+    missing_pmcids, dataset_dois, pending_datasets = scan_input_files(csv_files, doi_mappings, api_cache,
+                                                                      doi_repository_files)
+
+    if missing_pmcids:
+        print(f"Step 2: Found {len(missing_pmcids)} missing PMCIDs, batch fetching DOIs...")
+        new_dois = batch_fetch_dois(sorted(missing_pmcids), api_cache=api_cache)
+        print(f"  Fetched {len(new_dois)} new DOIs from API")
+    else:
+        print("Step 2: All PMCIDs already have DOIs or cached lookups, skipping API calls")
+    missing_pmcids = None
+
+    # Datasets cited next to a PMCID that was just resolved are only kept if it got a DOI
+    for pmcid, pmcid_datasets in pending_datasets.items():
+        if api_cache.get(pmcid):
+            dataset_dois |= pmcid_datasets
+    pending_datasets = None
+
+    if doi_repository_files:
+        print(f"DataCite cache has {len(repository_publishers)} entries")
+        resolve_repository_publishers(dataset_dois, repository_publishers)
+        repository_publishers.commit()
+
+    print("Step 3: Writing formatted files...")
+    if workers > 1:
+        write_files_in_parallel(csv_files, output_dir, doi_mappings, repository_mappings,
+                                api_cache.cache, workers)
+        return
+
+    for csv_file in csv_files:
+        repo_name, standard_repo_name = get_repository_name(csv_file, repository_mappings)
+        output_file = os.path.join(output_dir, f"{repo_name}_formatted.csv")
+        for line in write_file_logged(csv_file, output_file, doi_mappings, standard_repo_name, api_cache,
+                                      repository_publishers):
+            print(line)
+
+
+def write_file_logged(csv_file, output_file, doi_mappings, repository_name, api_cache, repository_publishers):
+    """write_formatted_file, returning its log lines instead of printing them."""
+    lines = [f"Processing {os.path.basename(csv_file)} (Repository: {repository_name})..."]
+    try:
+        written, row_count = write_formatted_file(csv_file, output_file, doi_mappings, repository_name,
+                                                  api_cache, repository_publishers)
+        success_rate = (written / row_count) * 100 if row_count > 0 else 0
+        lines.append(f"  Created formatted CSV: {output_file} with {written}/{row_count} entries ({success_rate:.1f}%)")
+    except Exception as e:
+        lines.append(f"Error processing {csv_file}: {e}")
+    return lines
+
+
+def write_files_in_parallel(csv_files, output_dir, doi_mappings, repository_mappings, cache, workers):
+    """
+    Write the output files with a pool of ``workers`` processes.
+
+    Workers look DOIs up in a read-only SQLite copy of the PMCID -> DOI mappings and
+    in the API cache file, rather than each receiving a pickled copy of the mappings.
+    Input files that share an output file are written by one task, in input order,
+    so the result is the same as in a sequential run. Each task returns its log
+    lines, printed in input order once it is done.
+
+    The mappings file lives in a temporary directory of its own, removed even if
+    a worker fails, so no run ever reads the mappings of an earlier one.
+    """
+    tasks = {}
+    for csv_file in csv_files:
+        repo_name, standard_repo_name = get_repository_name(csv_file, repository_mappings)
+        output_file = os.path.join(output_dir, f"{repo_name}_formatted.csv")
+        tasks.setdefault(output_file, []).append((csv_file, output_file, standard_repo_name))
+
+    with tempfile.TemporaryDirectory(prefix='pmcid_doi_mappings-', dir=output_dir) as mapping_dir:
+        mapping_db = os.path.join(mapping_dir, "pmcid_doi_mappings.db")
+        write_doi_mapping_db(doi_mappings, mapping_db)
+        cache.commit()
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_reformat_worker,
+                                 initargs=(mapping_db, cache.path)) as executor:
+            for lines in executor.map(reformat_files_worker, tasks.values()):
+                for line in lines:
+                    print(line)
+
+
+# Lookups of a reformat worker process, opened by init_reformat_worker
+_worker_lookups = {}
+
+
+def init_reformat_worker(mapping_db, cache_path):
+    cache = ApiCache(cache_path, read_only=True)
+    configure_api_cache(cache)
+    _worker_lookups['doi_mappings'] = DoiMappingDB(mapping_db)
+    _worker_lookups['api_cache'] = cache.namespace(EUROPEPMC_NAMESPACE)
+    _worker_lookups['repository_publishers'] = cache.namespace(DATACITE_NAMESPACE)
+
+
+def reformat_files_worker(files):
+    """Write the (csv_file, output_file, repository_name) files of one task; returns the log lines."""
+    lines = []
+    for csv_file, output_file, repository_name in files:
+        lines.extend(write_file_logged(csv_file, output_file, _worker_lookups['doi_mappings'], repository_name,
+                                       _worker_lookups['api_cache'], _worker_lookups['repository_publishers']))
+    return lines
+
+
+def iter_citations(csv_file):
+    """Yield the (dataset_id, pmcid) of every complete row of an input file, streaming."""
+    with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Skip header
+
+        for row in reader:
+            if len(row) < 2 or not row[0] or not row[1]:
+                continue
+            yield row[0].strip(), row[1].strip()
+
+
+def scan_input_files(csv_files, doi_mappings, api_cache, doi_repository_files):
+    """
+    One pass over all input files, returning:
+
+    - the PMCIDs that have no DOI in the mappings or the cache
+    - the dataset DOIs (as cache keys) of "doi" repository rows whose PMCID has a DOI
+    - the dataset DOIs of "doi" repository rows whose PMCID is still missing, by PMCID
+
+    Rows whose PMCID is known to have no DOI are never written, so their datasets are left out.
+    """
+    missing_pmcids = set()
+    dataset_dois = set()
+    pending_datasets = {}
+    doi_repository_files = set(doi_repository_files)
+
+    for csv_file in csv_files:
+        collect_datasets = csv_file in doi_repository_files
+        try:
+            for dataset_id, pmcid in iter_citations(csv_file):
+                if pmcid in doi_mappings:
+                    has_doi = True
+                elif pmcid in missing_pmcids:
+                    has_doi = None
+                else:
+                    cached, doi = api_cache.lookup(pmcid)
+                    if not cached:
+                        missing_pmcids.add(pmcid)
+                        has_doi = None
+                    else:
+                        has_doi = doi is not None
+                if collect_datasets and has_doi is not False:
+                    dataset_doi = dataset_doi_key(dataset_id)
+                    if not dataset_doi.startswith('10.'):
+                        continue
+                    if has_doi:
+                        dataset_dois.add(dataset_doi)
+                    else:
+                        pending_datasets.setdefault(pmcid, set()).add(dataset_doi)
+        except Exception as e:
+            print(f"Error scanning {csv_file}: {e}")
+
+    return missing_pmcids, dataset_dois, pending_datasets
+
+
+def write_formatted_file(input_file, output_file, doi_mappings, repository_name, api_cache,
+                         repository_publishers=None):
+    """
+    Stream one input file into its formatted CSV, row by row through a buffered csv.writer.
+    Expects every PMCID of the file to be resolved already (see process_streaming).
+
+    Returns (rows written, rows read).
+    """
+    row_count = 0
+    written = 0
+
+    with open(output_file, 'w', encoding='utf-8', newline='', buffering=WRITE_BUFFER_SIZE) as f:
+        # Same line endings as the DataFrame.to_csv output of the per-file mode
+        writer = csv.writer(f, lineterminator='\n')
+
+        for dataset_id, pmcid in iter_citations(input_file):
+            row_count += 1
+            doi_url = doi_mappings.get(pmcid, '') or api_cache.get(pmcid, '')
+            if not doi_url:
+                continue
+
+            if repository_name == DOI_REPOSITORY:
+                repository = repository_publishers.get(dataset_doi_key(dataset_id))
+            else:
+                repository = repository_name
+            if not written:
+                writer.writerow(OUTPUT_COLUMNS)
+            writer.writerow((repository, dataset_id, doi_url))
+            written += 1
+
+        if not written:
+            # A DataFrame without rows has no columns either, so to_csv writes an empty line
+            f.write('\n')
+
+    return written, row_count
+
+
+def process_csv_file(input_file, output_file, doi_mappings, repository_name, api_cache,
+                     repository_publishers=None):
     """
     Process a single CSV file and create a reformatted version.
     First collect missing PMCIDs, then batch fetch them, then process the file.
@@ -60,14 +435,14 @@ def process_csv_file(input_file, output_file, doi_mappings, repository_name, api
         
         if missing_pmcids:
             print(f"  Step 2: Found {len(missing_pmcids)} missing PMCIDs, batch fetching DOIs...")
-            new_dois = batch_fetch_dois(list(missing_pmcids))
-            api_cache.update(new_dois)
+            new_dois = batch_fetch_dois(list(missing_pmcids), api_cache=api_cache)
             print(f"  Step 3: Fetched {len(new_dois)} new DOIs from API")
         else:
-            print(f"  Step 2: All PMCIDs already have DOIs, skipping API calls")
+            print(f"  Step 2: All PMCIDs already have DOIs or cached lookups, skipping API calls")
 
         print(f"  Step 3: Processing file and creating output...")
-        process_file_with_complete_data(input_file, output_file, doi_mappings, repository_name, api_cache)
+        process_file_with_complete_data(input_file, output_file, doi_mappings, repository_name, api_cache,
+                                        repository_publishers)
 
     except Exception as e:
         print(f"Error processing {input_file}: {e}")
@@ -98,75 +473,101 @@ def collect_missing_pmcids_for_file(csv_file, doi_mappings, api_cache):
     return missing_pmcids
 
 
-def batch_fetch_dois(pmcids, batch_size=1000):
-    """Fetch DOIs for multiple PMCIDs using the bulk search API."""
+def batch_fetch_dois(pmcids, batch_size=1000, concurrency=EUROPEPMC_CONCURRENCY, rate=EUROPEPMC_RATE,
+                     api_cache=None):
+    """
+    Fetch DOIs for multiple PMCIDs using the bulk search API.
+
+    Up to ``concurrency`` batches are fetched at once, sharing a token bucket of
+    ``rate`` requests per second. With an ``api_cache``, the results of every batch
+    are cached as soon as it completes, with negative entries for PMCIDs that have no DOI.
+    """
     doi_results = {}
     total_batches = (len(pmcids) + batch_size - 1) // batch_size
-    
-    for i in range(0, len(pmcids), batch_size):
-        batch = pmcids[i:i + batch_size]
-        batch_num = (i // batch_size) + 1
-        
-        print(f"    Processing batch {batch_num}/{total_batches} ({len(batch)} PMCIDs)...")
-        
-        # Format PMCIDs for query (ensure they have PMC prefix)
-        formatted_pmcids = []
-        for pmcid in batch:
-            if not pmcid.startswith('PMC'):
-                formatted_pmcids.append(f'PMC{pmcid}')
-            else:
-                formatted_pmcids.append(pmcid)
-        
-        # Create query string: PMCID:(PMC123 OR PMC456 OR ...)
-        query = f"PMCID:({' OR '.join(formatted_pmcids)})"
-        
-        try:
-            response = fetch_batch_from_api(query)
-            if response:
-                # Extract DOIs from response
-                batch_dois = extract_dois_from_response(response)
-                doi_results.update(batch_dois)
-                print(f"    Batch {batch_num}: Found DOIs for {len(batch_dois)} PMCIDs")
-            
-            # Rate limiting - wait between batches
-            if batch_num < total_batches:
-                time.sleep(1)  # 1 second between batches
-                
-        except Exception as e:
-            print(f"    Error processing batch {batch_num}: {e}")
-            time.sleep(5)  # Wait longer on error
-    
+    limiter = TokenBucket(rate)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {}
+        for i in range(0, len(pmcids), batch_size):
+            batch = pmcids[i:i + batch_size]
+            batch_num = (i // batch_size) + 1
+            futures[executor.submit(fetch_batch_dois, batch, limiter)] = (batch_num, batch)
+
+        for future in as_completed(futures):
+            batch_num, batch = futures[future]
+            try:
+                batch_dois = future.result()
+            except Exception as e:
+                print(f"    Error processing batch {batch_num}/{total_batches}: {e}")
+                continue
+            if batch_dois is None:
+                print(f"    Batch {batch_num}/{total_batches}: request failed, PMCIDs left unresolved")
+                continue
+            doi_results.update(batch_dois)
+            if api_cache is not None:
+                without_doi = [pmcid for pmcid in batch if format_pmcid(pmcid) not in batch_dois]
+                api_cache.update({**dict.fromkeys(without_doi), **batch_dois})
+            print(f"    Batch {batch_num}/{total_batches}: Found DOIs for {len(batch_dois)}/{len(batch)} PMCIDs")
+
     return doi_results
 
 
-def fetch_batch_from_api(query):
-    """Make a single batch request to the EuropePMC search API."""
-    url = "https://www.ebi.ac.uk/europepmc/webservices/rest/searchPOST"
-    
+def fetch_batch_dois(batch, limiter):
+    """Resolve one batch of PMCIDs, following cursorMark pagination. Returns None if a request failed."""
+    # Format PMCIDs for query (ensure they have PMC prefix)
+    formatted_pmcids = [format_pmcid(pmcid) for pmcid in batch]
+
+    # Create query string: PMCID:(PMC123 OR PMC456 OR ...)
+    query = f"PMCID:({' OR '.join(formatted_pmcids)})"
+
+    batch_dois = {}
+    cursor_mark = '*'
+    while True:
+        response = fetch_batch_from_api(query, limiter, cursor_mark)
+        if response is None:
+            return None
+        batch_dois.update(extract_dois_from_response(response))
+
+        next_cursor_mark = response.get('nextCursorMark')
+        results = response.get('resultList', {}).get('result', [])
+        if not next_cursor_mark or next_cursor_mark == cursor_mark or len(results) < EUROPEPMC_PAGE_SIZE:
+            return batch_dois
+        cursor_mark = next_cursor_mark
+
+
+def format_pmcid(pmcid):
+    """PMCID with its PMC prefix, as the API returns it."""
+    return pmcid if pmcid.startswith('PMC') else f'PMC{pmcid}'
+
+
+def fetch_batch_from_api(query, limiter, cursor_mark='*'):
+    """Make a single search request (one page) to the EuropePMC search API."""
     data = {
         'query': query,
         'resultType': 'lite',
-        'pageSize': 1000,
+        'pageSize': EUROPEPMC_PAGE_SIZE,
+        'cursorMark': cursor_mark,
         'format': 'json'
     }
-    
-    try:
-        response = requests.post(
-            url,
-            data=urlencode(data),
-            headers={'Content-Type': 'application/x-www-form-urlencoded'},
-            timeout=30
-        )
-        
-        if response.status_code == 200:
+
+    response = request_with_backoff(
+        'POST',
+        EUROPEPMC_SEARCH_URL,
+        limiter,
+        data=urlencode(data),
+        headers={'Content-Type': 'application/x-www-form-urlencoded'},
+        timeout=30
+    )
+    if response is None:
+        return None
+    if response.status_code == 200:
+        try:
             return response.json()
-        else:
-            print(f"    API returned status code {response.status_code}")
+        except ValueError as e:
+            print(f"    Invalid JSON from API: {e}")
             return None
-            
-    except Exception as e:
-        print(f"    API request error: {e}")
-        return None
+    print(f"    API returned status code {response.status_code}")
+    return None
 
 
 def extract_dois_from_response(response_data):
@@ -190,8 +591,14 @@ def extract_dois_from_response(response_data):
     return doi_mappings
 
 
-def process_file_with_complete_data(input_file, output_file, doi_mappings, repository_name, api_cache):
-    """Process the CSV file now that we have all the DOI data."""
+def process_file_with_complete_data(input_file, output_file, doi_mappings, repository_name, api_cache,
+                                    repository_publishers=None):
+    """
+    Process the CSV file now that we have all the DOI data.
+
+    Rows of the "doi" repository get the publisher of their dataset DOI from
+    ``repository_publishers`` (see resolve_repository_publishers).
+    """
     output_data = []
     row_count = 0
     found_dois = 0
@@ -213,10 +620,12 @@ def process_file_with_complete_data(input_file, output_file, doi_mappings, repos
 
             if doi_url:
                 found_dois += 1
-                if repository_name == 'doi':
-                    repository_name = get_repository_from_api(dataset_id)
+                if repository_name == DOI_REPOSITORY:
+                    repository = (repository_publishers or {}).get(dataset_doi_key(dataset_id))
+                else:
+                    repository = repository_name
                 output_data.append({
-                    'repository': repository_name,
+                    'repository': repository,
                     'dataset': dataset_id,
                     'publication': doi_url
                 })
@@ -228,25 +637,58 @@ def process_file_with_complete_data(input_file, output_file, doi_mappings, repos
     print(f"  Found DOIs for {found_dois}/{row_count} PMCIDs")
 
 
-def load_api_cache(cache_file):
-    """Load previously cached API responses."""
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading API cache: {e}")
-            return {}
-    return {}
+def open_api_cache(output_dir):
+    """
+    Open the persistent API cache in the output directory, importing the JSON
+    caches written by earlier versions the first time.
+    """
+    cache = ApiCache(os.path.join(output_dir, "api_cache.db"))
+    configure_api_cache(cache)
+    for namespace, json_file in ((EUROPEPMC_NAMESPACE, "api_cache.json"), (DATACITE_NAMESPACE, "datacite_cache.json")):
+        imported = cache.import_json(namespace, os.path.join(output_dir, json_file))
+        if imported:
+            print(f"Imported {imported} entries from {json_file} into the API cache")
+    return cache
+
 
+def configure_api_cache(cache):
+    cache.set_ttl(EUROPEPMC_NAMESPACE, CACHE_TTL, CACHE_NEGATIVE_TTL)
+    cache.set_ttl(DATACITE_NAMESPACE, CACHE_TTL, CACHE_NEGATIVE_TTL)
 
-def save_api_cache(cache, cache_file):
-    """Save API cache to a file for future use."""
+
+def write_doi_mapping_db(doi_mappings, db_file):
+    """Write the PMCID -> DOI mappings to an SQLite file that worker processes can share read-only."""
+    building_file = db_file + '.building'
+    for path in (db_file, building_file):
+        if os.path.exists(path):
+            os.remove(path)
+
+    conn = sqlite3.connect(building_file)
     try:
-        with open(cache_file, 'w') as f:
-            json.dump(cache, f)
-    except Exception as e:
-        print(f"Error saving API cache: {e}")
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('CREATE TABLE doi_mappings (pmcid TEXT PRIMARY KEY, doi TEXT NOT NULL) WITHOUT ROWID')
+        # Sorted, so the primary key is built by appending
+        conn.executemany('INSERT INTO doi_mappings (pmcid, doi) VALUES (?, ?)', sorted(doi_mappings.items()))
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(building_file, db_file)
+
+
+class DoiMappingDB:
+    """Read-only PMCID -> DOI lookups in a file written by write_doi_mapping_db, used like the mappings dict."""
+
+    def __init__(self, db_file):
+        self.conn = sqlite3.connect(f'file:{db_file}?mode=ro', uri=True)
+        self.conn.execute('PRAGMA mmap_size = 1073741824')
+
+    def get(self, pmcid, default=None):
+        row = self.conn.execute('SELECT doi FROM doi_mappings WHERE pmcid = ?', (pmcid,)).fetchone()
+        return row[0] if row else default
+
+    def __contains__(self, pmcid):
+        return self.get(pmcid) is not None
 
 
 def load_doi_mappings(mapping_file):
@@ -284,31 +726,91 @@ def load_repository_mappings():
         return json.load(f)
 
 
-def get_repository_from_api(doi):
-    """Fetch repository (publisher) information from DataCite API."""
-    if not doi or not doi.startswith('10.'):
-        return None
+def dataset_doi_key(dataset_id):
+    """Key of a dataset DOI in the DataCite cache; DOIs are case-insensitive."""
+    return dataset_id.strip().lower()
 
-    api_url = f"https://api.datacite.org/dois/{doi}"
 
-    try:
-        time.sleep(0.02)
-        response = requests.get(api_url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            if 'data' in data and 'attributes' in data['data']:
-                return data['data']['attributes'].get('publisher', None)
-        elif response.status_code == 429:
-            print(f"Rate limit exceeded for DOI {doi}. Retrying after 60 seconds...")
-            time.sleep(60)
-            return get_repository_from_api(doi)  # Retry after waiting
-        else:
-            print(f"DataCite API returned status code {response.status_code} for DOI {doi}")
+def collect_dataset_dois(csv_files, doi_mappings, api_cache):
+    """
+    Unique dataset DOIs (as cache keys) cited in the given files, on rows whose
+    PMCID has a DOI; other rows are never written, so their datasets aren't needed.
+    """
+    dataset_dois = set()
+    for csv_file in csv_files:
+        try:
+            for dataset_id, pmcid in iter_citations(csv_file):
+                if not (doi_mappings.get(pmcid) or api_cache.get(pmcid)):
+                    continue
+                dataset_doi = dataset_doi_key(dataset_id)
+                if dataset_doi.startswith('10.'):
+                    dataset_dois.add(dataset_doi)
+        except Exception as e:
+            print(f"Error collecting dataset DOIs from {csv_file}: {e}")
+    return dataset_dois
 
-        return None
-    except Exception as e:
-        print(f"API error for DOI {doi}: {e}")
-        return None
+
+def resolve_repository_publishers(dataset_dois, publishers, concurrency=DATACITE_CONCURRENCY, rate=DATACITE_RATE):
+    """
+    Look up the DataCite publisher of every dataset DOI (as collected across all
+    files by collect_dataset_dois or scan_input_files, from rows that will be written).
+
+    DOIs already in ``publishers`` (the DataCite cache, updated in place) are not
+    requested again; a DOI DataCite doesn't know is cached as None. Up to
+    ``concurrency`` requests run at once, sharing a token bucket of ``rate``
+    requests per second.
+    """
+    to_resolve = sorted(doi for doi in dataset_dois if doi not in publishers)
+    print(f"Resolving repositories of {len(to_resolve)} dataset DOIs with DataCite "
+          f"({len(dataset_dois) - len(to_resolve)} of {len(dataset_dois)} already cached)...")
+    if not to_resolve:
+        return
+
+    limiter = TokenBucket(rate)
+    resolved = failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {executor.submit(get_repository_from_api, doi, limiter): doi for doi in to_resolve}
+        for future in as_completed(futures):
+            doi = futures[future]
+            try:
+                found, publisher = future.result()
+            except Exception as e:
+                print(f"API error for DOI {doi}: {e}")
+                found = False
+            if found:
+                publishers[doi] = publisher
+                resolved += 1
+            else:
+                failed += 1
+            if (resolved + failed) % 1000 == 0:
+                print(f"  {resolved + failed}/{len(to_resolve)} dataset DOIs looked up")
+
+    print(f"Resolved {resolved} dataset DOIs, {failed} failed and will be retried on the next run")
+
+
+def get_repository_from_api(doi, limiter):
+    """
+    Fetch repository (publisher) information from DataCite API.
+
+    Returns (True, publisher) once DataCite answered, with None as publisher for a
+    DOI it doesn't know, and (False, None) if the request failed.
+    """
+    if not doi or not doi.startswith('10.'):
+        return True, None
+
+    response = request_with_backoff('GET', f"{DATACITE_API_URL}/{doi}", limiter, timeout=10)
+    if response is None:
+        return False, None
+    if response.status_code == 200:
+        data = response.json()
+        if 'data' in data and 'attributes' in data['data']:
+            return True, data['data']['attributes'].get('publisher', None)
+        return True, None
+    if response.status_code == 404:
+        return True, None
+
+    print(f"DataCite API returned status code {response.status_code} for DOI {doi}")
+    return False, None
 
 
 if __name__ == "__main__":
@@ -0,0 +1,125 @@
+"""
+Tests of the EuropePMC batch fetcher in eupmc_reformat_csv.py against a local stub server.
+
+Run from the repository root with: python -m pytest corpus-v4/data_ingestion/tests
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import eupmc_reformat_csv as eupmc  # noqa: E402
+
+
+class StubEuropePMC:
+    """
+    searchPOST stub. Every PMCID in the query gets one result with a DOI, served in
+    pages of the requested pageSize with cursorMark set to the offset of the next page.
+    ``failures`` is a list of status codes answered before the real responses.
+    """
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.requests = []  # (time, form data) of every request
+        self.lock = threading.Lock()
+
+    def respond(self, form):
+        with self.lock:
+            self.requests.append((time.monotonic(), form))
+            if self.failures:
+                return self.failures.pop(0), {}
+        pmcids = form['query'].split('(', 1)[1].rstrip(')').split(' OR ')
+        results = [{'pmcid': pmcid, 'doi': f'10.1234/{pmcid.lower()}'} for pmcid in pmcids]
+        start = 0 if form['cursorMark'] == '*' else int(form['cursorMark'])
+        page = results[start:start + int(form['pageSize'])]
+        next_cursor = str(start + len(page)) if page else form['cursorMark']
+        return 200, {'resultList': {'result': page}, 'nextCursorMark': next_cursor}
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    """Start a stub server on a free port and point the fetcher at it; yields a function to set the stub."""
+    current = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+            form = {key: values[0] for key, values in parse_qs(body).items()}
+            status, payload = current['stub'].respond(form)
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            if status == 429:
+                self.send_header('Retry-After', '0')
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(eupmc, 'EUROPEPMC_SEARCH_URL', f'http://127.0.0.1:{server.server_port}/searchPOST')
+    monkeypatch.setattr(eupmc, 'BACKOFF_BASE', 0.01)
+
+    def use(stub):
+        current['stub'] = stub
+        return stub
+
+    yield use
+    server.shutdown()
+    server.server_close()
+
+
+def test_follows_cursor_mark_pagination(stub_server, monkeypatch):
+    stub = stub_server(StubEuropePMC())
+    monkeypatch.setattr(eupmc, 'EUROPEPMC_PAGE_SIZE', 2)
+
+    result = eupmc.batch_fetch_dois(['PMC1', 'PMC2', 'PMC3', '4', 'PMC5'], concurrency=1, rate=100)
+
+    assert result == {f'PMC{i}': f'https://doi.org/10.1234/pmc{i}' for i in range(1, 6)}
+    assert [form['cursorMark'] for _, form in stub.requests] == ['*', '2', '4']
+
+
+def test_retries_429_and_503_with_backoff(stub_server):
+    stub = stub_server(StubEuropePMC(failures=[429, 503]))
+
+    result = eupmc.batch_fetch_dois(['PMC7'], concurrency=1, rate=100)
+
+    assert result == {'PMC7': 'https://doi.org/10.1234/pmc7'}
+    assert len(stub.requests) == 3
+
+
+def test_gives_up_after_max_retries(stub_server, monkeypatch):
+    monkeypatch.setattr(eupmc, 'MAX_RETRIES', 2)
+    stub = stub_server(StubEuropePMC(failures=[503] * 10))
+
+    assert eupmc.batch_fetch_dois(['PMC7'], concurrency=1, rate=100) == {}
+    assert len(stub.requests) == 3
+
+
+def test_token_bucket_limits_request_rate(stub_server):
+    stub = stub_server(StubEuropePMC())
+    rate = 10
+    pmcids = [f'PMC{i}' for i in range(30)]
+
+    result = eupmc.batch_fetch_dois(pmcids, batch_size=1, concurrency=4, rate=rate)
+
+    assert len(result) == 30
+    times = sorted(t for t, _ in stub.requests)
+    # The bucket starts full (``rate`` tokens), then refills at ``rate`` per second
+    assert times[-1] - times[0] >= (len(times) - rate) / rate * 0.9
+    for i, start in enumerate(times):
+        in_window = sum(1 for t in times[i:] if t - start < 1.0)
+        assert in_window <= 2 * rate + 1
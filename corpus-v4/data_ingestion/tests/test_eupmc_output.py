@@ -0,0 +1,91 @@
+"""
+Tests that the streaming and parallel writers of eupmc_reformat_csv.py produce the
+same files as the pandas writer of the per-file mode.
+
+Run from the repository root with: python -m pytest corpus-v4/data_ingestion/tests
+"""
+
+import os
+import sys
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import eupmc_reformat_csv as eupmc  # noqa: E402
+from api_cache import ApiCache  # noqa: E402
+
+DOI_MAPPINGS = {'PMC1': 'https://doi.org/10.1234/pmc1'}
+API_CACHE = {'PMC2': 'https://doi.org/10.1234/pmc2'}
+REPOSITORY_PUBLISHERS = {'10.5061/dryad.1': 'Dryad', '10.5281/zenodo.2': 'Zenodo'}
+
+
+def write_both(tmp_path, input_text, repository_name='GEO'):
+    """Write one input file with both writers and return (pandas output, streaming output)."""
+    input_file = tmp_path / 'input.csv'
+    input_file.write_text(input_text, encoding='utf-8')
+    outputs = []
+    for writer in (eupmc.process_file_with_complete_data, eupmc.write_formatted_file):
+        output_file = tmp_path / f'{writer.__name__}.csv'
+        writer(str(input_file), str(output_file), DOI_MAPPINGS, repository_name, API_CACHE, REPOSITORY_PUBLISHERS)
+        outputs.append(output_file.read_bytes())
+    return outputs
+
+
+@pytest.mark.parametrize('input_text', [
+    '',
+    'dataset,pmcid\n',
+    'dataset,pmcid\nGSE1,PMC9\nGSE2,\n',
+], ids=['empty file', 'header only', 'no resolved rows'])
+def test_matches_pandas_without_rows(tmp_path, input_text):
+    pandas_output, streaming_output = write_both(tmp_path, input_text)
+
+    assert pandas_output == b'\n'
+    assert streaming_output == pandas_output
+
+
+def test_matches_pandas_with_rows(tmp_path):
+    pandas_output, streaming_output = write_both(tmp_path, 'dataset,pmcid\nGSE1,PMC1\nGSE2,PMC9\n"GSE,3", PMC2 \n')
+
+    assert pandas_output.startswith(b'repository,dataset,publication\n')
+    assert streaming_output == pandas_output
+
+
+def test_matches_pandas_for_doi_repository(tmp_path):
+    pandas_output, streaming_output = write_both(
+        tmp_path, 'dataset,pmcid\n10.5061/DRYAD.1,PMC1\n10.5281/zenodo.2,PMC2\n10.9999/unknown,PMC1\n',
+        repository_name=eupmc.DOI_REPOSITORY)
+
+    assert b'Dryad,10.5061/DRYAD.1' in pandas_output
+    assert streaming_output == pandas_output
+
+
+def test_parallel_writer_matches_sequential_and_cleans_up(tmp_path):
+    input_file = tmp_path / 'GEO.csv'
+    input_file.write_text('dataset,pmcid\nGSE1,PMC1\nGSE2,PMC9\n', encoding='utf-8')
+    cache = ApiCache(str(tmp_path / 'cache.db'))
+    output_dir = tmp_path / 'output'
+    output_dir.mkdir()
+
+    eupmc.write_files_in_parallel([str(input_file)], str(output_dir), DOI_MAPPINGS, {}, cache, workers=2)
+    cache.close()
+
+    assert os.listdir(output_dir) == ['GEO_formatted.csv']
+    assert (output_dir / 'GEO_formatted.csv').read_bytes() == (
+        b'repository,dataset,publication\nGEO,GSE1,https://doi.org/10.1234/pmc1\n')
+
+
+def test_parallel_writer_removes_mappings_when_a_worker_fails(tmp_path):
+    input_file = tmp_path / 'GEO.csv'
+    input_file.write_text('dataset,pmcid\nGSE1,PMC1\n', encoding='utf-8')
+    cache = ApiCache(str(tmp_path / 'cache.db'))
+    # Workers open the cache read-only, which fails for a missing file
+    cache.path = str(tmp_path / 'missing.db')
+    output_dir = tmp_path / 'output'
+    output_dir.mkdir()
+
+    with pytest.raises(BrokenProcessPool):
+        eupmc.write_files_in_parallel([str(input_file)], str(output_dir), DOI_MAPPINGS, {}, cache, workers=2)
+    cache.close()
+
+    assert os.listdir(output_dir) == []
@@ -0,0 +1,60 @@
+"""
+CSV flattening rules for the published corpus.
+
+Shared by convert_to_csv.py (JSON chunk files -> CSV) and the single-pass
+exporter (database rows -> JSON and CSV), so both produce identical rows.
+"""
+
+CSV_HEADER = ['id', 'created', 'updated', 'repository', 'publisher', 'journal', 'title',
+              'dataset', 'publication', 'publishedDate',
+              'source', 'subjects', 'affiliations', 'affiliationsROR', 'funders', 'fundersROR'
+             ]
+
+
+def get_ror_info(org):
+    ror_name = org.get('ror_name', 'NONE')
+    ror_id = org.get('ror_id', 'NONE')
+    return f"{ror_name} {ror_id}".strip()
+
+def get_row(record):
+    """Flatten one assertion_details_formatted record into a CSV row ordered like CSV_HEADER."""
+    # Basic details
+    id = record['id']
+    created = record['created']
+    updated = record['updated']
+    title = record['title']
+    dataset = record['dataset']
+    publication = record['publication']
+    publishedDate = record.get('publishedDate', '')
+    source = record.get('source', '')
+
+    # Repository
+    repository_data = record.get('repository', {})
+    repository_title = repository_data.get('title','')
+    repository_external_id = repository_data.get('external_id','')
+    repository = f"{repository_title} {repository_external_id}" if repository_external_id else repository_title
+
+    # Publisher
+    publisher_data = record.get('publisher', {})
+    publisher_title = publisher_data.get('title','')
+    publisher_external_id = publisher_data.get('external_id','')
+    publisher = f"{publisher_title} {publisher_external_id}" if publisher_external_id else publisher_title
+
+    # Journal
+    journal_data = record.get('journal', {})
+    journal_title = journal_data.get('title','')
+    journal_external_id = journal_data.get('external_id','')
+    journal = f"{journal_title} {journal_external_id}" if journal_external_id else journal_title
+
+    # Subjects
+    subjects = '; '.join(record.get('subjects', []))
+
+    # Affiliations
+    affiliations = '; '.join([f"{aff['title']}{' ' + aff['external_id'] if aff.get('external_id') else ''}" for aff in record.get('affiliations', [])])
+    affiliationsROR = '; '.join([get_ror_info(aff) for aff in record.get('affiliations', [])])
+
+    # Funders
+    funders = '; '.join([f"{funder['title']}{' ' + funder['external_id'] if funder.get('external_id') else ''}" for funder in record.get('funders', [])])
+    fundersROR = '; '.join([get_ror_info(funder) for funder in record.get('funders', [])])
+
+    return [id, created, updated, repository, publisher, journal, title, dataset, publication, publishedDate, source, subjects, affiliations, affiliationsROR, funders, fundersROR]
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Time the builds of assertion_details_formatted against each other on synthetic data.
+
+A scratch schema is filled with a generated copy of the tables the build reads
+(assertions, repositories, publishers, journals, sources, affiliations, funders,
+subjects and their junction tables). Each build script in sql-queries/ is then
+run against it with the scratch schema first on the search_path, and the
+resulting tables are compared row by row so a faster build can't silently
+produce a different table.
+
+Usage:
+    python benchmark_assertion_details_build.py --assertions 1000000 --runs 3
+"""
+
+import argparse
+import logging
+import os
+import re
+import statistics
+import time
+
+import psycopg2
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+# Load the environment variables from the .env file
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+dotenv_path = os.path.join(project_root, '.env')
+load_dotenv(dotenv_path)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Database connection details
+conn_params = {
+    'dbname': os.getenv('DB_NAME'),
+    'user': os.getenv('DB_USER'),
+    'password': os.getenv('DB_PASSWORD'),
+    'host': os.getenv('DB_HOST'),
+    'port': os.getenv('DB_PORT')
+}
+
+SQL_DIR = os.path.join(project_root, 'sql-queries')
+BUILDS = {
+    'multiple-queries': 'assertion_details_multiple_queries.sql',
+    'single-pass': 'assertion_details_single_pass.sql',
+}
+
+# Only schemas with this prefix are used, so a real schema can never be dropped by mistake
+SCHEMA_PREFIX = 'bench_'
+SCHEMA_PATTERN = re.compile(rf'^{SCHEMA_PREFIX}[a-z0-9_]+$')
+DEFAULT_SCHEMA = SCHEMA_PREFIX + 'assertion_details'
+DEFAULT_ASSERTIONS = 100000
+
+# Ids are derived from md5 hashes so the data set is identical between runs
+SYNTHETIC_DATA = """
+    CREATE TABLE repositories (id uuid PRIMARY KEY, title text, external_id text,
+                               created timestamp DEFAULT now(), updated timestamp DEFAULT now());
+    CREATE TABLE publishers (LIKE repositories INCLUDING ALL);
+    CREATE TABLE journals (LIKE repositories INCLUDING ALL);
+    CREATE TABLE sources (id uuid PRIMARY KEY, abbreviation text);
+    CREATE TABLE affiliations (id uuid PRIMARY KEY, title text, external_id text, ror_name text, ror_id text,
+                               created timestamp DEFAULT now(), updated timestamp DEFAULT now());
+    CREATE TABLE funders (LIKE affiliations INCLUDING ALL);
+    CREATE TABLE subjects (id uuid PRIMARY KEY, title text,
+                           created timestamp DEFAULT now(), updated timestamp DEFAULT now());
+    CREATE TABLE assertions (id uuid PRIMARY KEY, created timestamp, updated timestamp,
+                             repository_id uuid, publisher_id uuid, journal_id uuid, source_id uuid,
+                             title text, dataset text, publication text, published_date timestamp);
+    CREATE TABLE assertions_affiliations (id uuid PRIMARY KEY, assertion_id uuid, affiliation_id uuid,
+                                          created timestamp DEFAULT now(), updated timestamp DEFAULT now());
+    CREATE TABLE assertions_funders (id uuid PRIMARY KEY, assertion_id uuid, funder_id uuid,
+                                     created timestamp DEFAULT now(), updated timestamp DEFAULT now());
+    CREATE TABLE assertions_subjects (id uuid PRIMARY KEY, assertion_id uuid, subject_id uuid,
+                                      created timestamp DEFAULT now(), updated timestamp DEFAULT now());
+
+    INSERT INTO repositories (id, title, external_id)
+        SELECT md5('repository' || i)::uuid, 'Repository ' || i,
+               CASE WHEN i %% 2 = 0 THEN 'https://ror.org/r' || i END
+        FROM generate_series(0, 199) i;
+    INSERT INTO publishers (id, title, external_id)
+        SELECT md5('publisher' || i)::uuid, 'Publisher ' || i, NULL
+        FROM generate_series(0, 499) i;
+    INSERT INTO journals (id, title, external_id)
+        SELECT md5('journal' || i)::uuid, 'Journal ' || i, 'issn' || i
+        FROM generate_series(0, 4999) i;
+    INSERT INTO sources (id, abbreviation)
+        VALUES (md5('source0')::uuid, 'datacite'), (md5('source1')::uuid, 'eupmc');
+    INSERT INTO affiliations (id, title, external_id, ror_name, ror_id)
+        SELECT md5('affiliation' || i)::uuid, 'Affiliation ' || i,
+               CASE WHEN i %% 3 = 0 THEN 'ext' || i END, 'ROR ' || i, 'https://ror.org/a' || i
+        FROM generate_series(0, 9999) i;
+    INSERT INTO funders (id, title, external_id, ror_name, ror_id)
+        SELECT md5('funder' || i)::uuid, 'Funder ' || i, NULL, NULL, NULL
+        FROM generate_series(0, 1999) i;
+    INSERT INTO subjects (id, title)
+        SELECT md5('subject' || i)::uuid, 'subject ' || i
+        FROM generate_series(0, 299) i;
+
+    INSERT INTO assertions
+        SELECT md5('assertion' || i)::uuid, now() - interval '10 days', now() - interval '5 days',
+               CASE WHEN i %% 7 <> 0 THEN md5('repository' || (i %% 200))::uuid END,
+               CASE WHEN i %% 3 = 0 THEN md5('publisher' || (i %% 500))::uuid END,
+               CASE WHEN i %% 4 = 0 THEN md5('journal' || (i %% 5000))::uuid END,
+               md5('source' || (i %% 2))::uuid,
+               'Title ' || i, 'https://doi.org/10.1/ds' || i, 'https://doi.org/10.2/pub' || i,
+               now() - interval '1 year'
+        FROM generate_series(1, %(assertions)s) i;
+    INSERT INTO assertions_affiliations (id, assertion_id, affiliation_id)
+        SELECT md5('assertion_affiliation' || i || '-' || k)::uuid, md5('assertion' || i)::uuid,
+               md5('affiliation' || ((i * 7 + k) %% 10000))::uuid
+        FROM generate_series(1, %(assertions)s) i, generate_series(1, 2) k
+        WHERE i %% 3 <> 0;
+    INSERT INTO assertions_funders (id, assertion_id, funder_id)
+        SELECT md5('assertion_funder' || i)::uuid, md5('assertion' || i)::uuid,
+               md5('funder' || (i %% 2000))::uuid
+        FROM generate_series(1, %(assertions)s) i
+        WHERE i %% 5 = 0;
+    INSERT INTO assertions_subjects (id, assertion_id, subject_id)
+        SELECT md5('assertion_subject' || i || '-' || k)::uuid, md5('assertion' || i)::uuid,
+               md5('subject' || ((i + k) %% 300))::uuid
+        FROM generate_series(1, %(assertions)s) i, generate_series(1, 3) k
+        WHERE i %% 2 = 0;
+    ANALYZE;
+"""
+
+# json has no equality operator, and the order of aggregated arrays is not defined,
+# so each row is compared as jsonb with its arrays sorted
+SNAPSHOT_QUERY = """
+    DROP TABLE IF EXISTS {snapshot};
+    CREATE TABLE {snapshot} AS
+    SELECT id, created, updated, repository::jsonb, publisher::jsonb, journal::jsonb, title, dataset,
+           publication, "publishedDate", source,
+           (SELECT coalesce(jsonb_agg(e ORDER BY e), '[]') FROM jsonb_array_elements(affiliations::jsonb) e) AS affiliations,
+           (SELECT coalesce(jsonb_agg(e ORDER BY e), '[]') FROM jsonb_array_elements(funders::jsonb) e) AS funders,
+           (SELECT coalesce(jsonb_agg(e ORDER BY e), '[]') FROM jsonb_array_elements(subjects::jsonb) e) AS subjects
+    FROM assertion_details_formatted;
+"""
+
+COMPARE_QUERY = """
+    SELECT
+        (SELECT count(*) FROM (SELECT * FROM {first} EXCEPT ALL SELECT * FROM {second}) d),
+        (SELECT count(*) FROM (SELECT * FROM {second} EXCEPT ALL SELECT * FROM {first}) d)
+"""
+
+
+def get_connection(schema):
+    """Connect in autocommit mode with the scratch schema first on the search_path."""
+    conn = psycopg2.connect(**conn_params, options=f'-c search_path={schema}')
+    conn.autocommit = True
+    return conn
+
+
+def create_schema(schema):
+    """Create the scratch schema, refusing to reuse one that already exists."""
+    with psycopg2.connect(**conn_params) as conn:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_namespace WHERE nspname = %s", (schema,))
+            if cur.fetchone():
+                raise RuntimeError(f"Schema {schema} already exists, drop it or pick another --schema")
+            cur.execute(sql.SQL('CREATE SCHEMA {}').format(sql.Identifier(schema)))
+
+
+def drop_schema(schema):
+    """Drop the scratch schema and everything in it."""
+    with psycopg2.connect(**conn_params) as conn:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL('DROP SCHEMA IF EXISTS {} CASCADE').format(sql.Identifier(schema)))
+
+
+def create_synthetic_data(schema, assertions):
+    """Fill the scratch schema with ``assertions`` generated assertions."""
+    conn = get_connection(schema)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SYNTHETIC_DATA, {'assertions': assertions})
+    finally:
+        conn.close()
+
+
+def run_build(schema, build):
+    """Run one build script on a fresh connection and return the elapsed seconds."""
+    with open(os.path.join(SQL_DIR, BUILDS[build]), 'r') as f:
+        sql = f.read()
+    # Each script creates session temp tables, so every run gets its own connection
+    conn = get_connection(schema)
+    try:
+        start = time.perf_counter()
+        with conn.cursor() as cur:
+            cur.execute(sql)
+        return time.perf_counter() - start
+    finally:
+        conn.close()
+
+
+def snapshot_result(schema, build):
+    """Copy the freshly built table into a comparable snapshot table and return its name."""
+    snapshot = 'result_' + build.replace('-', '_')
+    conn = get_connection(schema)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SNAPSHOT_QUERY.format(snapshot=snapshot))
+    finally:
+        conn.close()
+    return snapshot
+
+
+def compare_results(schema, first, second):
+    """Return the number of rows only in ``first`` and only in ``second``."""
+    conn = get_connection(schema)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(COMPARE_QUERY.format(first=first, second=second))
+            return cur.fetchone()
+    finally:
+        conn.close()
+
+
+def benchmark(schema, assertions, runs, builds, keep=False):
+    if not SCHEMA_PATTERN.match(schema):
+        raise ValueError(f"Scratch schema names must match {SCHEMA_PATTERN.pattern}, got {schema!r}")
+    create_schema(schema)
+
+    timings = {}
+    snapshots = {}
+    try:
+        logger.info(f"Generating {assertions} synthetic assertions in schema {schema}")
+        start = time.perf_counter()
+        create_synthetic_data(schema, assertions)
+        logger.info(f"Synthetic data generated in {time.perf_counter() - start:.1f}s")
+
+        for build in builds:
+            timings[build] = []
+            for run in range(1, runs + 1):
+                elapsed = run_build(schema, build)
+                timings[build].append(elapsed)
+                logger.info(f"{build} run {run}/{runs}: {elapsed:.2f}s")
+            snapshots[build] = snapshot_result(schema, build)
+
+        reference = builds[0]
+        for build in builds[1:]:
+            only_reference, only_build = compare_results(schema, snapshots[reference], snapshots[build])
+            if only_reference or only_build:
+                logger.error(f"{build} differs from {reference}: {only_reference} rows only in {reference}, "
+                             f"{only_build} rows only in {build}")
+            else:
+                logger.info(f"{build} produces the same table as {reference}")
+
+        print(f"\n{'build':<20}{'min':>10}{'median':>10}{'max':>10}")
+        for build in builds:
+            times = timings[build]
+            print(f"{build:<20}{min(times):>9.2f}s{statistics.median(times):>9.2f}s{max(times):>9.2f}s")
+        for build in builds[1:]:
+            speedup = statistics.median(timings[reference]) / statistics.median(timings[build])
+            print(f"{build} is {speedup:.2f}x the speed of {reference} (median)")
+    finally:
+        if not keep:
+            drop_schema(schema)
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the assertion_details_formatted builds on synthetic data")
+    parser.add_argument('--assertions', type=int, default=DEFAULT_ASSERTIONS,
+                        help=f"Number of synthetic assertions (default: {DEFAULT_ASSERTIONS})")
+    parser.add_argument('--runs', type=int, default=3, help="Runs per build (default: 3)")
+    parser.add_argument('--builds', default=','.join(BUILDS),
+                        help=f"Comma-separated builds to compare, the first is the reference (default: {','.join(BUILDS)})")
+    parser.add_argument('--schema', default=DEFAULT_SCHEMA,
+                        help=f"Scratch schema to create and drop, must not exist yet and must start with "
+                             f"{SCHEMA_PREFIX} (default: {DEFAULT_SCHEMA})")
+    parser.add_argument('--keep', action='store_true', help="Keep the scratch schema after the benchmark")
+    args = parser.parse_args()
+
+    builds = [build.strip() for build in args.builds.split(',') if build.strip()]
+    unknown = [build for build in builds if build not in BUILDS]
+    if unknown:
+        parser.error(f"Unknown builds: {', '.join(unknown)} (choose from {', '.join(BUILDS)})")
+    if not SCHEMA_PATTERN.match(args.schema):
+        parser.error(f"--schema must start with {SCHEMA_PREFIX} and only contain lowercase letters, digits and _")
+
+    benchmark(args.schema, args.assertions, args.runs, builds, args.keep)
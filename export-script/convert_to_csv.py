@@ -1,74 +1,95 @@
+import argparse
 import json
 import csv
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+from assertion_csv import CSV_HEADER, get_row
 
-def get_ror_info(org):
-    ror_name = org.get('ror_name', 'NONE')
-    ror_id = org.get('ror_id', 'NONE')
-    return f"{ror_name} {ror_id}".strip()
+READ_SIZE = 1024 * 1024
+WRITE_BUFFER_SIZE = 1024 * 1024
 
-def get_all_data(json_file, output_dir):
-    base_filename = os.path.splitext(os.path.basename(json_file))[0]
-    outfile = os.path.join(output_dir, f"{base_filename}.csv")
-
-    with open(outfile, 'w', newline='', encoding='utf-8') as f_out:
-      writer = csv.writer(f_out)
-      writer.writerow(
-        ['id', 'created', 'updated', 'repository', 'publisher', 'journal', 'title',
-         'dataset', 'publication', 'publishedDate',
-         'source', 'subjects', 'affiliations', 'affiliationsROR', 'funders', 'fundersROR'
-        ]
-      )
-    with open(json_file, 'r', encoding='utf-8') as f_in:
-      json_data = json.load(f_in)
-    for record in json_data:
-        # Basic details
-        id = record['id']
-        created = record['created']
-        updated = record['updated']
-        title = record['title']
-        dataset = record['dataset']
-        publication = record['publication']
-        publishedDate = record.get('publishedDate', '')
-        source = record.get('source', '')
+# Characters allowed between records: array brackets, commas and whitespace (covers JSON arrays and JSON Lines)
+RECORD_SEPARATORS = frozenset('[],\r\n\t ')
 
-        # Repository
-        repository_data = record.get('repository', {})
-        repository_title = repository_data.get('title','')
-        repository_external_id = repository_data.get('external_id','')
-        repository = f"{repository_title} {repository_external_id}" if repository_external_id else repository_title
 
-        # Publisher
-        publisher_data = record.get('publisher', {})
-        publisher_title = publisher_data.get('title','')
-        publisher_external_id = publisher_data.get('external_id','')
-        publisher = f"{publisher_title} {publisher_external_id}" if publisher_external_id else publisher_title
+def iter_json_records(f_in, read_size=READ_SIZE):
+    """
+    Yield records one at a time from a JSON array or JSON Lines file.
 
-        # Journal
-        journal_data = record.get('journal', {})
-        journal_title = journal_data.get('title','')
-        journal_external_id = journal_data.get('external_id','')
-        journal = f"{journal_title} {journal_external_id}" if journal_external_id else journal_title
+    The file is read ``read_size`` characters at a time and decoded incrementally,
+    so memory use is bounded by the largest record rather than the file size.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in RECORD_SEPARATORS:
+            pos += 1
+        if pos < len(buffer):
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Most likely a record split across reads; only fatal once the file is exhausted
+                if eof:
+                    raise
+            else:
+                yield record
+                continue
+        elif eof:
+            return
+        chunk = f_in.read(read_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
 
-        # Subjects
-        subjects = '; '.join(record.get('subjects', []))
+def get_all_data(json_file, output_dir):
+    base_filename = os.path.splitext(os.path.basename(json_file))[0]
+    outfile = os.path.join(output_dir, f"{base_filename}.csv")
 
-        # Affiliations
-        affiliations = '; '.join([f"{aff['title']}{' ' + aff['external_id'] if aff.get('external_id') else ''}" for aff in record.get('affiliations', [])])
-        affiliationsROR = '; '.join([get_ror_info(aff) for aff in record.get('affiliations', [])])
+    records = 0
+    with open(json_file, 'r', encoding='utf-8') as f_in, \
+         open(outfile, 'w', newline='', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as f_out:
+      writer = csv.writer(f_out)
+      writer.writerow(CSV_HEADER)
+      for record in iter_json_records(f_in):
+          writer.writerow(get_row(record))
+          records += 1
+    return records
 
-        # Funders
-        funders = '; '.join([f"{funder['title']}{' ' + funder['external_id'] if funder.get('external_id') else ''}" for funder in record.get('funders', [])])
-        fundersROR = '; '.join([get_ror_info(funder) for funder in record.get('funders', [])])
+def convert_files(json_files, output_dir, jobs=1):
+    """Convert several chunk files, ``jobs`` at a time. Returns the list of files that failed."""
+    if jobs <= 1 or len(json_files) <= 1:
+        failed = []
+        for json_file in json_files:
+            try:
+                records = get_all_data(json_file, output_dir)
+                print(f"Converted {json_file} ({records} records)")
+            except Exception as e:
+                print(f"Error converting {json_file}: {e}", file=sys.stderr)
+                failed.append(json_file)
+        return failed
 
-        with open(outfile, 'a', newline='', encoding='utf-8') as f_out:
-            writer = csv.writer(f_out)
-            writer.writerow([id, created, updated, repository, publisher, journal, title, dataset, publication, publishedDate, source, subjects, affiliations, affiliationsROR, funders, fundersROR])
+    failed = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(get_all_data, json_file, output_dir): json_file for json_file in json_files}
+        for future in as_completed(futures):
+            json_file = futures[future]
+            try:
+                records = future.result()
+                print(f"Converted {json_file} ({records} records)")
+            except Exception as e:
+                print(f"Error converting {json_file}: {e}", file=sys.stderr)
+                failed.append(json_file)
+    return failed
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print("Usage: python script.py input.json")
+    parser = argparse.ArgumentParser(description="Convert corpus JSON (array or JSON Lines) chunk files to CSV")
+    parser.add_argument('json_files', nargs='+', help="One or more chunk files to convert")
+    parser.add_argument('output_dir', help="Directory for the CSV files")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of files to convert in parallel")
+    args = parser.parse_args()
+    if convert_files(args.json_files, args.output_dir, args.jobs):
         sys.exit(1)
-    get_all_data(sys.argv[1], sys.argv[2])
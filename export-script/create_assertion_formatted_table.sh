@@ -1,6 +1,12 @@
 #!/bin/bash
 
 # This script creates assertion details from the PostgreSQL database.
+# Usage: ./create_assertion_formatted_table.sh [--incremental | --single-pass]
+#   --incremental  only recompute rows for assertions (or the rows linked to them) changed since the
+#                  last build, instead of dropping and rebuilding the whole table
+# A full build first installs the change log read by --incremental.
+#   --single-pass  rebuild the whole table with one CREATE TABLE AS over pre-aggregated affiliations,
+#                  funders and subjects, swapped in atomically once it is indexed
 # The script is designed to run on a local machine and requires the following:
 # - psql (PostgreSQL client) installed on the local machine
 # - Access to the PostgreSQL database (host, name, user, and password)
@@ -22,13 +28,56 @@ if [[ -z "$DB_HOST" || -z "$DB_USER" || -z "$DB_NAME" || -z "$DB_PASSWORD" ]]; t
     exit 1
 fi
 
-FILE_PATH="$SCRIPT_PARENT_DIR/sql-queries/assertion_details_multiple_queries.sql"
+BUILD_MODE="full"
+if [[ "$1" == "--incremental" ]]; then
+    BUILD_MODE="incremental"
+elif [[ "$1" == "--single-pass" ]]; then
+    BUILD_MODE="single-pass"
+elif [[ -n "$1" ]]; then
+    echo "Usage: $0 [--incremental | --single-pass]"
+    exit 1
+fi
 
 start_time=$(date +%s)
 
-echo "creating assertion details table in the database..."
-PGPASSWORD="$DB_PASSWORD" psql -f "$FILE_PATH" -h "$DB_HOST" -U "$DB_USER" -d "$DB_NAME"
-echo "assertion details table created successfully."
+if [[ "$BUILD_MODE" == "incremental" ]]; then
+    FILE_PATH="$SCRIPT_PARENT_DIR/sql-queries/assertion_details_incremental_refresh.sql"
+
+    HAS_PREVIOUS_BUILD=$(PGPASSWORD="$DB_PASSWORD" psql -h "$DB_HOST" -U "$DB_USER" -d "$DB_NAME" -tA -c "SELECT to_regclass('assertion_details_formatted') IS NOT NULL AND to_regclass('assertion_details_build_state') IS NOT NULL;")
+    if [[ "$HAS_PREVIOUS_BUILD" != "t" ]]; then
+        echo "Error: No previous build of assertion_details_formatted found, run the script without --incremental first."
+        exit 1
+    fi
+
+    HAS_CHANGE_LOG=$(PGPASSWORD="$DB_PASSWORD" psql -h "$DB_HOST" -U "$DB_USER" -d "$DB_NAME" -tA -c "SELECT to_regclass('assertion_details_changes') IS NOT NULL;")
+    if [[ "$HAS_CHANGE_LOG" != "t" ]]; then
+        echo "Error: The change log was not installed by the last build, deleted links and in-place edits would be missed. Run the script without --incremental first."
+        exit 1
+    fi
+
+    echo "refreshing changed rows of the assertion details table in the database..."
+    PGPASSWORD="$DB_PASSWORD" psql -v ON_ERROR_STOP=1 -f "$FILE_PATH" -h "$DB_HOST" -U "$DB_USER" -d "$DB_NAME" || exit 1
+    echo "assertion details table refreshed successfully."
+else
+    # Install the change log before the build starts, so no change made during the build is missed,
+    # even on the first build
+    echo "installing the change log for incremental refreshes..."
+    PGPASSWORD="$DB_PASSWORD" psql -v ON_ERROR_STOP=1 -f "$SCRIPT_PARENT_DIR/sql-queries/assertion_details_change_log.sql" -h "$DB_HOST" -U "$DB_USER" -d "$DB_NAME" || exit 1
+fi
+
+if [[ "$BUILD_MODE" == "single-pass" ]]; then
+    FILE_PATH="$SCRIPT_PARENT_DIR/sql-queries/assertion_details_single_pass.sql"
+
+    echo "creating assertion details table in the database in a single pass..."
+    PGPASSWORD="$DB_PASSWORD" psql -v ON_ERROR_STOP=1 -f "$FILE_PATH" -h "$DB_HOST" -U "$DB_USER" -d "$DB_NAME" || exit 1
+    echo "assertion details table created successfully."
+elif [[ "$BUILD_MODE" == "full" ]]; then
+    FILE_PATH="$SCRIPT_PARENT_DIR/sql-queries/assertion_details_multiple_queries.sql"
+
+    echo "creating assertion details table in the database..."
+    PGPASSWORD="$DB_PASSWORD" psql -f "$FILE_PATH" -h "$DB_HOST" -U "$DB_USER" -d "$DB_NAME"
+    echo "assertion details table created successfully."
+fi
 
 end_time=$(date +%s)
 
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+Export assertion_details_formatted to the per-chunk JSON/CSV corpus layout.
+
+The table is read in id order using keyset pagination (``WHERE id > last_id``)
+through a named server-side cursor, so every chunk costs the same regardless
+of its position in the table and the total export time grows linearly with
+the corpus size. Each row is read once and written to the JSON and CSV files
+of its chunk at the same time.
+
+The export runs in one REPEATABLE READ transaction, so every chunk sees the
+same snapshot of the table. With ``--workers N`` the id keyspace is split into
+ranges at boundaries estimated from a sample of the ids, and the ranges are
+exported concurrently by worker processes, each range on a database connection
+of its own that is closed once the range is written. Every range imports the
+snapshot of the main transaction (``pg_export_snapshot``), so the ranges
+together hold exactly the rows counted at the start. Chunks hold roughly ``--chunk-size`` records each rather than
+exactly, so the files are split differently from a sequential export.
+
+Besides JSON and CSV, chunks can be written as Parquet (``--formats``), with
+nested fields kept as typed list/struct columns.
+
+Output files can be compressed while they are written (``--compression``),
+and a manifest.json listing every file with its record count, size and
+SHA-256 checksum is written next to the json/ and csv/ directories.
+
+With ``--record-watermark`` the export is recorded as a release watermark (see
+export_state.py), taken from the same snapshot as the exported rows; without it
+the export only reads from the database. ``--delta`` exports only the records
+inserted or updated since the last recorded release, in the same schema, plus
+a tombstone file listing the ids deleted since then.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+import psycopg2
+from dotenv import load_dotenv
+
+from export_state import (DELETED_IDS_QUERY, FIRST_DELTA_CHUNK_QUERY, NEXT_DELTA_CHUNK_QUERY, get_last_release,
+                          record_release)
+from export_writers import (COMPRESSION_SUFFIXES, COMPRESSIONS, JSON_FORMATS, OUTPUT_FORMATS, ChunkWriters, OutputFile,
+                            output_writer_class)
+
+# Load the environment variables from the .env file
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+dotenv_path = os.path.join(project_root, '.env')
+load_dotenv(dotenv_path)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Database connection details
+conn_params = {
+    'dbname': os.getenv('DB_NAME'),
+    'user': os.getenv('DB_USER'),
+    'password': os.getenv('DB_PASSWORD'),
+    'host': os.getenv('DB_HOST'),
+    'port': os.getenv('DB_PORT')
+}
+
+DEFAULT_CHUNK_SIZE = 1000000
+DEFAULT_FETCH_SIZE = 10000
+DEFAULT_CORPUS_VERSION = 'v4.0'
+DEFAULT_FORMATS = ('json', 'csv')
+MANIFEST_FILENAME = 'manifest.json'
+FULL_FILE_PREFIX = 'data-citation-corpus'
+DELTA_FILE_PREFIX = 'data-citation-corpus-delta'
+
+# Where and how the files of each chunk are written
+ChunkLayout = namedtuple('ChunkLayout', ['output_dir', 'export_date', 'corpus_version', 'file_prefix', 'formats',
+                                         'json_format', 'compression', 'compression_level'])
+
+FIRST_CHUNK_QUERY = """
+    SELECT t.id, row_to_json(t)::text
+    FROM assertion_details_formatted t
+    ORDER BY t.id
+    LIMIT %s
+"""
+
+NEXT_CHUNK_QUERY = """
+    SELECT t.id, row_to_json(t)::text
+    FROM assertion_details_formatted t
+    WHERE t.id > %s
+    ORDER BY t.id
+    LIMIT %s
+"""
+
+RANGE_CHUNK_QUERY = """
+    SELECT t.id, row_to_json(t)::text
+    FROM assertion_details_formatted t
+    WHERE t.id >= %s AND t.id < %s
+    ORDER BY t.id
+"""
+
+LAST_RANGE_CHUNK_QUERY = """
+    SELECT t.id, row_to_json(t)::text
+    FROM assertion_details_formatted t
+    WHERE t.id >= %s
+    ORDER BY t.id
+"""
+
+# First id of every range: the smallest id, then the quantiles of a block sample
+# of the ids, so the whole table is never scanned to find the boundaries.
+CHUNK_BOUNDARIES_QUERY = """
+    WITH first_id AS (
+        SELECT id FROM assertion_details_formatted ORDER BY id LIMIT 1
+    ),
+    sampled AS (
+        SELECT percentile_disc(%(fractions)s::float8[]) WITHIN GROUP (ORDER BY id) AS ids
+        FROM assertion_details_formatted TABLESAMPLE SYSTEM (%(percent)s) REPEATABLE (0)
+    )
+    SELECT id FROM first_id
+    UNION
+    SELECT boundary
+    FROM sampled, unnest(sampled.ids) AS boundary, first_id
+    WHERE boundary > first_id.id
+    ORDER BY 1
+"""
+
+# Sampled ids per range used to estimate the boundaries
+SAMPLE_ROWS_PER_CHUNK = 1000
+
+
+def get_connection():
+    return psycopg2.connect(**conn_params)
+
+
+def get_export_connection():
+    """Open a read-only REPEATABLE READ UTF-8 connection for exporting."""
+    conn = get_connection()
+    conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    conn.set_client_encoding('UTF8')
+    return conn
+
+
+def chunk_filename(export_date, file_number, corpus_version, extension, file_prefix=FULL_FILE_PREFIX):
+    """Build the release file name for a chunk, e.g. 2025-01-01-data-citation-corpus-01-v4.0.json"""
+    return f"{export_date}-{file_prefix}-{file_number:02d}-{corpus_version}.{extension}"
+
+
+def format_elapsed(seconds):
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours} hours, {minutes} minutes, and {seconds} seconds"
+
+
+def open_chunk_writers(layout, file_number):
+    """Open the files of one chunk, one per output format, under ``output_dir/<format>``."""
+    writers = []
+    for output_format in layout.formats:
+        writer_class = output_writer_class(output_format, layout.json_format)
+        filename = chunk_filename(layout.export_date, file_number, layout.corpus_version, writer_class.extension,
+                                  layout.file_prefix)
+        if output_format != 'parquet':
+            filename += COMPRESSION_SUFFIXES[layout.compression]
+        path = os.path.join(layout.output_dir, output_format, filename)
+        writers.append(writer_class(path, layout.compression, layout.compression_level))
+    return ChunkWriters(writers)
+
+
+def write_tombstones(conn, layout, fetch_size):
+    """
+    Write the ids deleted since the last recorded release to ``output_dir/deleted``.
+
+    Returns (number of deleted ids, manifest entry of the tombstone file).
+    """
+    os.makedirs(os.path.join(layout.output_dir, 'deleted'), exist_ok=True)
+    filename = f"{layout.export_date}-{layout.file_prefix}-deleted-{layout.corpus_version}.csv"
+    path = os.path.join(layout.output_dir, 'deleted', filename + COMPRESSION_SUFFIXES[layout.compression])
+
+    deleted = 0
+    output = OutputFile(path, layout.compression, layout.compression_level, newline='')
+    try:
+        writer = csv.writer(output.stream)
+        writer.writerow(['id'])
+        with conn.cursor(name='assertion_details_deleted') as cur:
+            cur.execute(DELETED_IDS_QUERY)
+            while True:
+                rows = cur.fetchmany(fetch_size)
+                if not rows:
+                    break
+                writer.writerows(rows)
+                deleted += len(rows)
+    finally:
+        entry = output.close()
+    return deleted, dict(entry, records=deleted, path=path)
+
+
+def write_manifest(layout, files, export_type='full', since=None):
+    """Write manifest.json describing every file of the export, in path order."""
+    entries = sorted(
+        (dict(entry, path=os.path.relpath(entry['path'], layout.output_dir)) for entry in files),
+        key=lambda entry: entry['path']
+    )
+    manifest = {
+        'export_date': layout.export_date,
+        'corpus_version': layout.corpus_version,
+        'export_type': export_type,
+        'compression': layout.compression,
+        'files': entries
+    }
+    if since is not None:
+        manifest['since'] = since
+    manifest_path = os.path.join(layout.output_dir, MANIFEST_FILENAME)
+    with open(manifest_path, 'w', encoding='utf-8') as f_out:
+        json.dump(manifest, f_out, indent=2)
+        f_out.write('\n')
+    return manifest_path
+
+
+def stream_rows(conn, query, params, fetch_size, writer):
+    """
+    Run ``query`` on a named cursor and stream its (id, json) rows into ``writer``.
+
+    Rows are pulled from the server ``fetch_size`` at a time and written out
+    immediately, so at most one fetch batch is held in memory.
+    Returns the id of the last row written, or None if there were no rows.
+    """
+    last_id = None
+    # A named cursor keeps the result set on the server instead of buffering it client-side.
+    with conn.cursor(name='assertion_details_export') as cur:
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            for record_id, record_json in rows:
+                writer.write(record_json)
+            last_id = rows[-1][0]
+    return last_id
+
+
+def write_chunk(conn, last_id, chunk_size, fetch_size, writer,
+                first_query=FIRST_CHUNK_QUERY, next_query=NEXT_CHUNK_QUERY):
+    """
+    Stream the next chunk of records after ``last_id`` into ``writer``.
+
+    Returns the id of the last record written (``last_id`` if none were).
+    """
+    if last_id is None:
+        chunk_last_id = stream_rows(conn, first_query, (chunk_size,), fetch_size, writer)
+    else:
+        chunk_last_id = stream_rows(conn, next_query, (last_id, chunk_size), fetch_size, writer)
+    return chunk_last_id or last_id
+
+
+def get_chunk_boundaries(conn, chunk_size, records):
+    """
+    Return the first id of every range, in id order, for ranges of about ``chunk_size`` of ``records`` rows.
+
+    The boundaries are estimated from a sample, so the ranges are only roughly equal;
+    every row falls in exactly one range whatever the sample.
+    """
+    if records == 0:
+        return []
+    chunks = -(-records // chunk_size)
+    fractions = [k / chunks for k in range(1, chunks)]
+    percent = min(100.0, 100.0 * SAMPLE_ROWS_PER_CHUNK * chunks / records)
+    with conn.cursor() as cur:
+        cur.execute(CHUNK_BOUNDARIES_QUERY, {'fractions': fractions, 'percent': percent})
+        return [row[0] for row in cur.fetchall()]
+
+
+def export_snapshot(conn):
+    """Export the snapshot of the connection's transaction, valid for as long as the transaction stays open."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_export_snapshot()")
+        return cur.fetchone()[0]
+
+
+def _export_range(layout, file_number, start_id, end_id, fetch_size, snapshot):
+    """
+    Export the ids from ``start_id`` up to ``end_id`` (the end of the table if None) as they are in ``snapshot``.
+
+    Each range runs on a connection of its own, closed once the range is written,
+    so no idle connection or open transaction is left behind in the worker.
+    """
+    chunk_start = time.time()
+    conn = get_export_connection()
+    try:
+        writer = open_chunk_writers(layout, file_number)
+        try:
+            with conn.cursor() as cur:
+                # Must be the first statement of the transaction
+                cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+            if end_id is None:
+                stream_rows(conn, LAST_RANGE_CHUNK_QUERY, (start_id,), fetch_size, writer)
+            else:
+                stream_rows(conn, RANGE_CHUNK_QUERY, (start_id, end_id), fetch_size, writer)
+        finally:
+            records = writer.close()
+    finally:
+        conn.close()
+    return records, writer.files, time.time() - chunk_start
+
+
+def export_sequential(conn, layout, chunk_size, fetch_size, first_query=FIRST_CHUNK_QUERY, next_query=NEXT_CHUNK_QUERY):
+    """
+    Export every chunk in order on a single connection. Returns (records, manifest entries of the files).
+
+    ``first_query`` and ``next_query`` select the rows, e.g. only the changed ones for a delta export.
+    """
+    total_records = 0
+    files = []
+    file_number = 0
+    last_id = None
+    while True:
+        file_number += 1
+        writer = open_chunk_writers(layout, file_number)
+        logger.info(f"Processing chunk {file_number:02d} starting after id {last_id}")
+
+        chunk_start = time.time()
+        try:
+            last_id = write_chunk(conn, last_id, chunk_size, fetch_size, writer, first_query, next_query)
+        finally:
+            records = writer.close()
+        if records == 0:
+            for path in writer.paths:
+                os.remove(path)
+            break
+
+        total_records += records
+        files.extend(writer.files)
+        logger.info(f"Wrote {records} records to {', '.join(writer.paths)} in {format_elapsed(time.time() - chunk_start)}")
+
+        if records < chunk_size:
+            break
+    return total_records, files
+
+
+def export_parallel(conn, layout, chunk_size, fetch_size, workers, records, snapshot):
+    """
+    Export ranges of about ``chunk_size`` of the ``records`` rows concurrently in ``workers`` processes.
+
+    The workers read ``snapshot``, exported from ``conn``'s transaction, which must stay open until they are done.
+    Returns (records, manifest entries of the files).
+    """
+    boundaries = get_chunk_boundaries(conn, chunk_size, records)
+    ranges = list(zip(boundaries, boundaries[1:] + [None]))
+    logger.info(f"Split the table into {len(ranges)} chunks across {workers} workers")
+
+    total_records = 0
+    files = []
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_export_range, layout, file_number, start_id, end_id, fetch_size, snapshot): file_number
+            for file_number, (start_id, end_id) in enumerate(ranges, start=1)
+        }
+        for future in as_completed(futures):
+            file_number = futures[future]
+            try:
+                records, chunk_files, elapsed = future.result()
+            except Exception as e:
+                logger.error(f"Chunk {file_number:02d} failed: {e}")
+                failed.append(file_number)
+                continue
+            total_records += records
+            files.extend(chunk_files)
+            logger.info(f"Wrote {records} records to {', '.join(f['path'] for f in chunk_files)} in {format_elapsed(elapsed)}")
+
+    if failed:
+        raise RuntimeError(f"Export failed for chunks: {', '.join(f'{n:02d}' for n in sorted(failed))}")
+    return total_records, files
+
+
+def export_assertion_details(output_dir, chunk_size=DEFAULT_CHUNK_SIZE, fetch_size=DEFAULT_FETCH_SIZE,
+                             export_date=None, corpus_version=DEFAULT_CORPUS_VERSION, json_format='array',
+                             workers=1, compression=None, compression_level=None, formats=DEFAULT_FORMATS,
+                             delta=False, record_watermark=False):
+    """
+    Export the table into one ``output_dir/<format>`` directory per output format.
+
+    A full export writes every record; a delta export writes the records inserted
+    or updated since the last recorded release plus a tombstone file of deleted ids.
+    If ``record_watermark`` is True, the export is then recorded as the new
+    watermark, which writes to the database. Returns the number of records exported.
+    """
+    export_date = export_date or date.today().isoformat()
+    layout = ChunkLayout(output_dir, export_date, corpus_version, DELTA_FILE_PREFIX if delta else FULL_FILE_PREFIX,
+                         tuple(formats), json_format, compression, compression_level)
+    for output_format in layout.formats:
+        os.makedirs(os.path.join(output_dir, output_format), exist_ok=True)
+
+    deleted = 0
+    since = None
+    conn = get_export_connection()
+    try:
+        # Shared with the export workers and the watermark, so they all see the table as of this point
+        snapshot = export_snapshot(conn)
+        if delta:
+            last_release = get_last_release(conn)
+            if last_release is None:
+                raise RuntimeError("No recorded release to compare against, run a full export first")
+            since = last_release['export_date'].isoformat()
+            logger.info(f"Exporting changes since the {last_release['export_type']} release of {since} "
+                        f"(max updated {last_release['max_updated']})")
+            if workers > 1:
+                logger.info("Delta exports run on a single connection, ignoring --workers")
+            total_records, files = export_sequential(conn, layout, chunk_size, fetch_size,
+                                                     FIRST_DELTA_CHUNK_QUERY, NEXT_DELTA_CHUNK_QUERY)
+            deleted, tombstone = write_tombstones(conn, layout, fetch_size)
+            files.append(tombstone)
+            logger.info(f"Wrote {deleted} deleted ids to {tombstone['path']}")
+        else:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM assertion_details_formatted;")
+                expected_records = cur.fetchone()[0]
+            logger.info(f"Total records to process: {expected_records}")
+
+            if workers > 1:
+                total_records, files = export_parallel(conn, layout, chunk_size, fetch_size, workers, expected_records,
+                                                       snapshot)
+            else:
+                total_records, files = export_sequential(conn, layout, chunk_size, fetch_size)
+            if total_records != expected_records:
+                raise RuntimeError(f"Exported {total_records} records, but the table holds {expected_records}")
+
+        manifest_path = write_manifest(layout, files, 'delta' if delta else 'full', since)
+        logger.info(f"Exported {total_records} records into {len(files)} files, manifest written to {manifest_path}")
+
+        if record_watermark:
+            # Recorded while the export transaction is still open, so its snapshot can be imported
+            state_conn = get_connection()
+            state_conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+            try:
+                max_updated = record_release(state_conn, export_date, corpus_version, 'delta' if delta else 'full',
+                                             total_records, deleted, snapshot)
+            finally:
+                state_conn.close()
+            logger.info(f"Recorded release watermark (max updated {max_updated})")
+    finally:
+        conn.close()
+    return total_records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export assertion_details_formatted to chunked JSON, CSV and Parquet files")
+    parser.add_argument('output_dir', help="Directory that will receive one sub-directory per output format")
+    parser.add_argument('--formats', default=','.join(DEFAULT_FORMATS),
+                        help=f"Comma-separated output formats out of {', '.join(OUTPUT_FORMATS)} (default: json,csv)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Records per output file")
+    parser.add_argument('--fetch-size', type=int, default=DEFAULT_FETCH_SIZE, help="Rows fetched from the server per round trip")
+    parser.add_argument('--json-format', choices=JSON_FORMATS, default='array',
+                        help="Write each chunk as a JSON array (default) or as JSON Lines")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of chunks exported concurrently, each on its own database connection")
+    parser.add_argument('--compression', choices=COMPRESSIONS,
+                        help="Compress each file while it is written (zstd needs the zstandard package)")
+    parser.add_argument('--compression-level', type=int, help="Compression level (default: 6 for gzip, 10 for zstd)")
+    parser.add_argument('--delta', action='store_true',
+                        help="Only export records inserted, updated or deleted since the last recorded release")
+    parser.add_argument('--record-watermark', action='store_true',
+                        help="Record this export as the watermark for the next delta export (writes to the database)")
+    parser.add_argument('--date', dest='export_date', help="Date prefix for file names (default: today)")
+    parser.add_argument('--corpus-version', default=DEFAULT_CORPUS_VERSION, help="Version suffix for file names")
+    args = parser.parse_args()
+    formats = [output_format.strip() for output_format in args.formats.split(',') if output_format.strip()]
+    unknown = [output_format for output_format in formats if output_format not in OUTPUT_FORMATS]
+    if unknown or not formats:
+        parser.error(f"unknown output format(s): {', '.join(unknown) or '(none given)'}")
+
+    start_time = time.time()
+    export_assertion_details(
+        args.output_dir,
+        chunk_size=args.chunk_size,
+        fetch_size=args.fetch_size,
+        export_date=args.export_date,
+        corpus_version=args.corpus_version,
+        json_format=args.json_format,
+        workers=args.workers,
+        compression=args.compression,
+        compression_level=args.compression_level,
+        formats=formats,
+        delta=args.delta,
+        record_watermark=args.record_watermark
+    )
+    logger.info(f"Total time taken: {format_elapsed(time.time() - start_time)}")
+
+
+if __name__ == '__main__':
+    main()
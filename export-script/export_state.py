@@ -0,0 +1,137 @@
+"""
+Release watermarks for incremental (delta) corpus exports.
+
+Every recorded release stores the maximum ``updated`` of assertion_details_formatted
+in corpus_export_releases, and a snapshot of the (id, updated) pairs it contained in
+corpus_export_state. A delta export compares the current table with that snapshot:
+
+- inserted: ids that are not in the snapshot
+- updated:  ids whose ``updated`` is newer than in the snapshot
+- deleted:  ids in the snapshot that are gone from the table, e.g. removed by the
+            cleanup queries in sql-queries/, which rebuild assertions rather than
+            updating rows in place
+"""
+
+CREATE_STATE_TABLES = """
+    CREATE TABLE IF NOT EXISTS corpus_export_releases (
+        id SERIAL PRIMARY KEY,
+        export_date DATE NOT NULL,
+        corpus_version TEXT NOT NULL,
+        export_type TEXT NOT NULL,
+        max_updated TIMESTAMP,
+        records BIGINT NOT NULL,
+        deleted BIGINT NOT NULL DEFAULT 0,
+        created TIMESTAMP NOT NULL DEFAULT now()
+    );
+    CREATE TABLE IF NOT EXISTS corpus_export_state AS
+        SELECT id, updated FROM assertion_details_formatted WITH NO DATA;
+    CREATE UNIQUE INDEX IF NOT EXISTS corpus_export_state_id_idx ON corpus_export_state (id);
+"""
+
+LAST_RELEASE_QUERY = """
+    SELECT export_date, corpus_version, export_type, max_updated, records
+    FROM corpus_export_releases
+    ORDER BY id DESC
+    LIMIT 1
+"""
+
+FIRST_DELTA_CHUNK_QUERY = """
+    SELECT t.id, row_to_json(t)::text
+    FROM assertion_details_formatted t
+    LEFT JOIN corpus_export_state s
+        ON s.id = t.id
+    WHERE s.id IS NULL OR t.updated > s.updated
+    ORDER BY t.id
+    LIMIT %s
+"""
+
+NEXT_DELTA_CHUNK_QUERY = """
+    SELECT t.id, row_to_json(t)::text
+    FROM assertion_details_formatted t
+    LEFT JOIN corpus_export_state s
+        ON s.id = t.id
+    WHERE (s.id IS NULL OR t.updated > s.updated) AND t.id > %s
+    ORDER BY t.id
+    LIMIT %s
+"""
+
+DELETED_IDS_QUERY = """
+    SELECT s.id
+    FROM corpus_export_state s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM assertion_details_formatted t WHERE t.id = s.id
+    )
+    ORDER BY s.id
+"""
+
+RECORD_RELEASE_QUERY = """
+    INSERT INTO corpus_export_releases (export_date, corpus_version, export_type, max_updated, records, deleted)
+    SELECT %s, %s, %s, max(updated), %s, %s
+    FROM assertion_details_formatted
+    RETURNING max_updated
+"""
+
+# Only the pairs that changed since the previous release are written, so the state
+# table does not fill up with dead rows and the WAL stays proportional to the changes
+REFRESH_STATE_QUERY = """
+    DELETE FROM corpus_export_state s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM assertion_details_formatted t WHERE t.id = s.id
+    );
+    INSERT INTO corpus_export_state (id, updated)
+        SELECT t.id, t.updated
+        FROM assertion_details_formatted t
+        LEFT JOIN corpus_export_state s
+            ON s.id = t.id
+        WHERE s.id IS NULL OR t.updated IS DISTINCT FROM s.updated
+    ON CONFLICT (id) DO UPDATE
+        SET updated = EXCLUDED.updated;
+"""
+
+
+def ensure_state_tables(conn):
+    """Create the watermark tables if they do not exist yet."""
+    with conn.cursor() as cur:
+        cur.execute(CREATE_STATE_TABLES)
+    conn.commit()
+
+
+def get_last_release(conn):
+    """Return the most recently recorded release as a dict, or None if there is none."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('corpus_export_releases') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return None
+        cur.execute(LAST_RELEASE_QUERY)
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return dict(zip(('export_date', 'corpus_version', 'export_type', 'max_updated', 'records'), row))
+
+
+def record_release(conn, export_date, corpus_version, export_type, records, deleted=0, snapshot=None):
+    """
+    Record a finished export as the new watermark.
+
+    The release row and the (id, updated) snapshot are written in one
+    transaction, so a failed refresh leaves the previous watermark in place.
+    ``snapshot`` is the id of the exported snapshot the export read (see
+    pg_export_snapshot); the watermark is then taken from that snapshot, so rows
+    changed while the export ran are left for the next delta. Importing it needs
+    a REPEATABLE READ ``conn`` and the exporting transaction to still be open.
+    Returns the maximum ``updated`` value of the release.
+    """
+    ensure_state_tables(conn)
+    try:
+        with conn.cursor() as cur:
+            if snapshot is not None:
+                # Must be the first statement of the transaction
+                cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+            cur.execute(RECORD_RELEASE_QUERY, (export_date, corpus_version, export_type, records, deleted))
+            max_updated = cur.fetchone()[0]
+            cur.execute(REFRESH_STATE_QUERY)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return max_updated
@@ -0,0 +1,308 @@
+"""
+Streaming writers for the corpus export.
+
+Each writer receives one assertion_details_formatted row at a time, both as
+the JSON text produced by ``row_to_json`` and (when a writer needs it) as the
+decoded record, and writes it straight to disk. The exporter therefore never
+holds more than the current fetch batch in memory, and the JSON text is only
+decoded once per row however many formats are written.
+
+Files can be compressed with gzip or zstd while they are written, and every
+file records its size and SHA-256 checksum for the release manifest.
+
+Parquet output keeps affiliations, funders and subjects as typed list/struct
+columns and needs the optional pyarrow package.
+"""
+
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+
+from assertion_csv import CSV_HEADER, get_row
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+JSON_FORMATS = ('array', 'jsonl')
+OUTPUT_FORMATS = ('json', 'csv', 'parquet')
+COMPRESSIONS = ('gzip', 'zstd')
+COMPRESSION_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+DEFAULT_COMPRESSION_LEVELS = {'gzip': 6, 'zstd': 10}
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+PARQUET_BATCH_SIZE = 10000
+PARQUET_COMPRESSION = {None: 'snappy', 'gzip': 'gzip', 'zstd': 'zstd'}
+# Columns with few distinct, heavily repeated values
+PARQUET_DICTIONARY_COLUMNS = [
+    'repository.title', 'repository.external_id',
+    'publisher.title', 'publisher.external_id',
+    'journal.title', 'journal.external_id',
+    'source', 'subjects.list.element'
+]
+
+
+class ChecksumFile(io.RawIOBase):
+    """Binary file that keeps a running SHA-256 and byte count of what is written to disk."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self._file = open(path, 'wb')
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._file.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+class OutputFile:
+    """
+    Text output file with optional streaming compression.
+
+    ``stream`` is a text stream; everything written to it is encoded,
+    compressed and checksummed on the way to disk.
+    """
+
+    def __init__(self, path, compression=None, level=None, newline=None):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.path = path
+        self._raw = ChecksumFile(path)
+        self._buffer = io.BufferedWriter(self._raw, buffer_size=WRITE_BUFFER_SIZE)
+        level = level or DEFAULT_COMPRESSION_LEVELS.get(compression)
+        if compression == 'gzip':
+            # mtime=0 keeps the output reproducible between runs
+            compressed = gzip.GzipFile(filename=os.path.splitext(os.path.basename(path))[0], mode='wb',
+                                       fileobj=self._buffer, compresslevel=level, mtime=0)
+        elif compression == 'zstd':
+            if zstandard is None:
+                raise ImportError("zstd compression requires the 'zstandard' package (pip install zstandard)")
+            compressed = zstandard.ZstdCompressor(level=level).stream_writer(self._buffer, closefd=False)
+        else:
+            compressed = self._buffer
+        self.stream = io.TextIOWrapper(compressed, encoding='utf-8', newline=newline)
+
+    def close(self):
+        """Flush and close the file, returning its manifest entry."""
+        self.stream.close()
+        if not self._buffer.closed:
+            self._buffer.close()
+        self._raw.close()
+        return {'bytes': self._raw.size, 'sha256': self._raw.sha256.hexdigest()}
+
+
+class JsonArrayWriter:
+    """Write records as a single JSON array, the format of the published corpus files."""
+
+    extension = 'json'
+    needs_record = False
+
+    def __init__(self, path, compression=None, level=None):
+        self.path = path
+        self.records = 0
+        self._output = OutputFile(path, compression, level)
+        self._file = self._output.stream
+        self._file.write('[')
+
+    def write(self, record_json, record=None):
+        if self.records:
+            self._file.write(',\n')
+        self._file.write(record_json)
+        self.records += 1
+
+    def close(self):
+        self._file.write(']\n')
+        return dict(self._output.close(), records=self.records)
+
+
+class JsonLinesWriter:
+    """Write one JSON record per line (JSON Lines)."""
+
+    extension = 'jsonl'
+    needs_record = False
+
+    def __init__(self, path, compression=None, level=None):
+        self.path = path
+        self.records = 0
+        self._output = OutputFile(path, compression, level)
+        self._file = self._output.stream
+
+    def write(self, record_json, record=None):
+        self._file.write(record_json)
+        self._file.write('\n')
+        self.records += 1
+
+    def close(self):
+        return dict(self._output.close(), records=self.records)
+
+
+class CsvWriter:
+    """Write records flattened with the rules in assertion_csv.py."""
+
+    extension = 'csv'
+    needs_record = True
+
+    def __init__(self, path, compression=None, level=None):
+        self.path = path
+        self.records = 0
+        self._output = OutputFile(path, compression, level, newline='')
+        self._writer = csv.writer(self._output.stream)
+        self._writer.writerow(CSV_HEADER)
+
+    def write(self, record_json, record=None):
+        self._writer.writerow(get_row(record))
+        self.records += 1
+
+    def close(self):
+        return dict(self._output.close(), records=self.records)
+
+
+def parquet_schema():
+    """Arrow schema mirroring the columns of assertion_details_formatted."""
+    entity = pa.struct([('title', pa.string()), ('external_id', pa.string())])
+    organization = pa.struct([
+        ('title', pa.string()), ('external_id', pa.string()),
+        ('ror_name', pa.string()), ('ror_id', pa.string())
+    ])
+    return pa.schema([
+        ('id', pa.string()),
+        ('created', pa.string()),
+        ('updated', pa.string()),
+        ('repository', entity),
+        ('publisher', entity),
+        ('journal', entity),
+        ('title', pa.string()),
+        ('dataset', pa.string()),
+        ('publication', pa.string()),
+        ('publishedDate', pa.string()),
+        ('source', pa.string()),
+        ('affiliations', pa.list_(organization)),
+        ('funders', pa.list_(organization)),
+        ('subjects', pa.list_(pa.string()))
+    ])
+
+
+class ParquetWriter:
+    """
+    Write records to a Parquet file in record batches of PARQUET_BATCH_SIZE rows.
+
+    The file compression setting selects the Parquet column codec instead of
+    wrapping the file, since Parquet compresses pages internally.
+    """
+
+    extension = 'parquet'
+    needs_record = True
+
+    def __init__(self, path, compression=None, level=None):
+        if pq is None:
+            raise ImportError("Parquet output requires the 'pyarrow' package (pip install pyarrow)")
+        self.path = path
+        self.records = 0
+        self._schema = parquet_schema()
+        self._columns = {name: [] for name in self._schema.names}
+        self._writer = pq.ParquetWriter(
+            path, self._schema,
+            compression=PARQUET_COMPRESSION[compression],
+            compression_level=level,
+            use_dictionary=PARQUET_DICTIONARY_COLUMNS
+        )
+
+    def write(self, record_json, record=None):
+        for name, values in self._columns.items():
+            value = record.get(name)
+            # '{}' marks a missing repository/publisher/journal; store it as a null struct
+            values.append(value if value != {} else None)
+        self.records += 1
+        if len(self._columns['id']) >= PARQUET_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._columns['id']:
+            return
+        batch = pa.RecordBatch.from_arrays(
+            [pa.array(self._columns[field.name], type=field.type) for field in self._schema],
+            schema=self._schema
+        )
+        self._writer.write_batch(batch)
+        for values in self._columns.values():
+            values.clear()
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+        sha256 = hashlib.sha256()
+        with open(self.path, 'rb') as f_in:
+            for block in iter(lambda: f_in.read(WRITE_BUFFER_SIZE), b''):
+                sha256.update(block)
+        return {'bytes': os.path.getsize(self.path), 'sha256': sha256.hexdigest(), 'records': self.records}
+
+
+class ChunkWriters:
+    """Fan each row out to every writer of a chunk, decoding the JSON at most once."""
+
+    def __init__(self, writers):
+        self.writers = writers
+        self.files = []
+        self._decode = any(writer.needs_record for writer in writers)
+
+    @property
+    def paths(self):
+        return [writer.path for writer in self.writers]
+
+    def write(self, record_json):
+        record = json.loads(record_json) if self._decode else None
+        for writer in self.writers:
+            writer.write(record_json, record)
+
+    def close(self):
+        """
+        Close every writer and return the number of records in the chunk.
+
+        The manifest entry of each file (path, records, bytes, sha256) is kept in ``files``.
+        """
+        self.files = [dict(writer.close(), path=writer.path) for writer in self.writers]
+        return self.files[0]['records'] if self.files else 0
+
+
+def output_writer_class(output_format, json_format='array'):
+    """Return the writer class for an output format (json, csv or parquet)."""
+    if output_format == 'json':
+        return json_writer_class(json_format)
+    if output_format == 'csv':
+        return CsvWriter
+    if output_format == 'parquet':
+        return ParquetWriter
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+def json_writer_class(json_format):
+    """Return the writer class for a --json-format value."""
+    if json_format == 'array':
+        return JsonArrayWriter
+    if json_format == 'jsonl':
+        return JsonLinesWriter
+    raise ValueError(f"Unknown JSON format: {json_format}")
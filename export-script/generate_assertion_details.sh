@@ -2,7 +2,7 @@
 
 # This script generates assertion details from the PostgreSQL database and saves them to JSON files.
 # The script is designed to run on a local machine and requires the following:
-# - psql (PostgreSQL client) installed on the local machine
+# - Python 3 with psycopg2 and python-dotenv installed on the local machine
 # - Access to the PostgreSQL database (host, name, user, and password)
 # - .env file in the root directory with values set for $DB_NAME, $DB_HOST, $DB_USER and $DB_PASSWORD
 
@@ -22,70 +22,46 @@ if [[ -z "$DB_HOST" || -z "$DB_USER" || -z "$DB_NAME" || -z "$DB_PASSWORD" ]]; t
     exit 1
 fi
 
-QUERY_PREFIX="SELECT json_agg(t) FROM (SELECT * FROM assertion_details_formatted ORDER BY id OFFSET "
-QUERY_SUFFIX=" LIMIT 1000000) t;"
 MAIN_OUTPUT_DIR="/Volumes/Storage/data-citation-corpus-v4.0-output" # TODO: Change this to your desired output directory
 JSON_OUTPUT_DIR="$MAIN_OUTPUT_DIR/json"
 CSV_OUTPUT_DIR="$MAIN_OUTPUT_DIR/csv"
 CURRENT_DATE=$(date +%Y-%m-%d)
 CHUNK_SIZE=1000000
-TOTAL_RECORDS=$(PGPASSWORD="$DB_PASSWORD" psql -h "$DB_HOST" -U "$DB_USER" -d "$DB_NAME" -tA -c "SELECT COUNT(*) FROM assertion_details_formatted;")
-FILE_NUMBER=0
+WORKERS=4 # number of chunks exported concurrently, each on its own database connection
+FORMATS="json,csv" # add parquet for a columnar copy of the corpus (needs pyarrow)
+COMPRESSION="gzip" # gzip or zstd to compress each file while it is written, empty to zip everything at the end
+COMPRESSION_LEVEL=6
+RECORD_WATERMARK=false # true for release runs, so the next --delta export compares against this one (writes to the database)
 JSON_ZIP_FILENAME="${CURRENT_DATE}-data-citation-corpus-v4.0-json.zip"
 CSV_ZIP_FILENAME="${CURRENT_DATE}-data-citation-corpus-v4.0-csv.zip"
-PYTHON_SCRIPT="$SCRIPT_PARENT_DIR/export-script/convert_to_csv.py"
-
-# Check if there was an error with psql connection
-if ! [[ "$TOTAL_RECORDS" -gt 0 ]]; then
-  echo "Error: Failed to get total records from the database. Exiting."
-  exit 1
-fi
-
-echo "Total records to process: $TOTAL_RECORDS"
+EXPORT_SCRIPT="$SCRIPT_PARENT_DIR/export-script/export_assertion_details.py"
 
 start_time=$(date +%s)
 
-mkdir -p "$JSON_OUTPUT_DIR"
-mkdir -p "$CSV_OUTPUT_DIR"
-
-function run_query_and_save_json() {
-    local offset=$1
-    local file_number_padded=$(printf "%02d" "$FILE_NUMBER")
-    echo "Processing chunk starting from $offset"
-    local output_file="$JSON_OUTPUT_DIR/${CURRENT_DATE}-data-citation-corpus-${file_number_padded}-v4.0.json"
-    local query="$QUERY_PREFIX$offset$QUERY_SUFFIX"
-    local start_time=$(date +%s)
-    PGPASSWORD="$DB_PASSWORD" psql -h "$DB_HOST" -U "$DB_USER" -d "$DB_NAME" -tA -c "SET CLIENT_ENCODING TO 'UTF8'; $query" -o "$output_file"
-    local end_time=$(date +%s)
-    local elapsed_time=$((end_time - start_time))
-    local hours=$((elapsed_time / 3600))
-    local minutes=$(( (elapsed_time % 3600) / 60 ))
-    local seconds=$((elapsed_time % 60))
-    echo "Query took $hours hours, $minutes minutes, and $seconds seconds."
-
-    # convert json file to csv in the background
-    python3 "$PYTHON_SCRIPT" "$output_file" "$CSV_OUTPUT_DIR" &
-}
-
 echo "Starting the process.."
-offset=0
-while [ "$offset" -lt "$TOTAL_RECORDS" ]; do
-    FILE_NUMBER=$((FILE_NUMBER + 1))
-    run_query_and_save_json "$offset"
-    offset=$((offset + CHUNK_SIZE))
-done
-
-wait # wait for all background processes to finish
-
-echo "Zipping the JSON files"
-cd "$JSON_OUTPUT_DIR" || exit 1
-zip -r "$MAIN_OUTPUT_DIR/$JSON_ZIP_FILENAME" ./*.json -x "*.DS_Store" || exit 1
-rm ./*.json
-
-echo "Zipping the CSV files"
-cd "$CSV_OUTPUT_DIR" || exit 1
-zip -r "$MAIN_OUTPUT_DIR/$CSV_ZIP_FILENAME" ./*.csv -x "*.DS_Store" || exit 1
-rm ./*.csv
+# The exporter reads the table once in id order (keyset pagination) and writes each chunk as JSON and CSV
+EXPORT_ARGS=(--formats "$FORMATS" --chunk-size "$CHUNK_SIZE" --workers "$WORKERS" --date "$CURRENT_DATE" --corpus-version "v4.0")
+if [[ -n "$COMPRESSION" ]]; then
+    EXPORT_ARGS+=(--compression "$COMPRESSION" --compression-level "$COMPRESSION_LEVEL")
+fi
+if [[ "$RECORD_WATERMARK" == "true" ]]; then
+    EXPORT_ARGS+=(--record-watermark)
+fi
+python3 "$EXPORT_SCRIPT" "$MAIN_OUTPUT_DIR" "${EXPORT_ARGS[@]}" || exit 1
+
+if [[ -n "$COMPRESSION" ]]; then
+    echo "Files were compressed while exporting, see $MAIN_OUTPUT_DIR/manifest.json for sizes and checksums"
+else
+    echo "Zipping the JSON files"
+    cd "$JSON_OUTPUT_DIR" || exit 1
+    zip -r "$MAIN_OUTPUT_DIR/$JSON_ZIP_FILENAME" ./*.json -x "*.DS_Store" || exit 1
+    rm ./*.json
+
+    echo "Zipping the CSV files"
+    cd "$CSV_OUTPUT_DIR" || exit 1
+    zip -r "$MAIN_OUTPUT_DIR/$CSV_ZIP_FILENAME" ./*.csv -x "*.DS_Store" || exit 1
+    rm ./*.csv
+fi
 
 end_time=$(date +%s)
 
@@ -0,0 +1,150 @@
+"""
+Tests of the release watermarks in export_state.py against a PostgreSQL database.
+
+The connection is configured like the export scripts, through DB_NAME, DB_USER,
+DB_PASSWORD, DB_HOST and DB_PORT; the tests are skipped if it cannot be opened.
+Every test runs in its own scratch schema, which is dropped afterwards.
+
+Run from the repository root with: python -m pytest export-script/tests
+"""
+
+import datetime
+import os
+import sys
+
+import psycopg2
+import pytest
+from psycopg2 import sql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import export_state  # noqa: E402
+
+SCHEMA = 'test_export_state'
+
+conn_params = {
+    'dbname': os.getenv('DB_NAME'),
+    'user': os.getenv('DB_USER'),
+    'password': os.getenv('DB_PASSWORD'),
+    'host': os.getenv('DB_HOST'),
+    'port': os.getenv('DB_PORT')
+}
+
+ROWS = [
+    ('00000000-0000-0000-0000-000000000001', datetime.datetime(2025, 1, 1)),
+    ('00000000-0000-0000-0000-000000000002', datetime.datetime(2025, 1, 2)),
+    ('00000000-0000-0000-0000-000000000003', datetime.datetime(2025, 1, 3)),
+]
+
+
+def connect(isolation_level=None):
+    conn = psycopg2.connect(**conn_params, options=f'-c search_path={SCHEMA}')
+    if isolation_level is not None:
+        conn.set_session(isolation_level=isolation_level)
+    return conn
+
+
+def execute(statement, params=None):
+    conn = connect()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(statement, params)
+            return cur.fetchall() if cur.description else None
+    finally:
+        conn.close()
+
+
+def state():
+    return sorted((str(record_id), updated) for record_id, updated in
+                  execute("SELECT id, updated FROM corpus_export_state"))
+
+
+@pytest.fixture(autouse=True)
+def scratch_schema():
+    try:
+        admin = psycopg2.connect(**conn_params)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"No database to test against: {e}")
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(sql.SQL('DROP SCHEMA IF EXISTS {} CASCADE').format(sql.Identifier(SCHEMA)))
+        cur.execute(sql.SQL('CREATE SCHEMA {}').format(sql.Identifier(SCHEMA)))
+    execute("CREATE TABLE assertion_details_formatted (id uuid PRIMARY KEY, updated timestamp)")
+    execute("INSERT INTO assertion_details_formatted (id, updated) VALUES " + ', '.join(['(%s, %s)'] * len(ROWS)),
+            [value for row in ROWS for value in row])
+    yield
+    with admin.cursor() as cur:
+        cur.execute(sql.SQL('DROP SCHEMA {} CASCADE').format(sql.Identifier(SCHEMA)))
+    admin.close()
+
+
+def record(export_type, records, deleted=0, snapshot=None, isolation_level=None):
+    conn = connect(isolation_level)
+    try:
+        return export_state.record_release(conn, datetime.date(2025, 2, 1), 'v4.0', export_type, records, deleted,
+                                           snapshot)
+    finally:
+        conn.close()
+
+
+def last_release():
+    conn = connect()
+    try:
+        return export_state.get_last_release(conn)
+    finally:
+        conn.close()
+
+
+def test_no_release_before_the_first_export():
+    assert last_release() is None
+
+
+def test_records_the_watermark_and_the_exported_pairs():
+    assert record('full', len(ROWS)) == datetime.datetime(2025, 1, 3)
+
+    assert last_release() == {
+        'export_date': datetime.date(2025, 2, 1),
+        'corpus_version': 'v4.0',
+        'export_type': 'full',
+        'max_updated': datetime.datetime(2025, 1, 3),
+        'records': len(ROWS),
+    }
+    assert state() == ROWS
+
+
+def test_rewrites_only_the_changed_pairs():
+    record('full', len(ROWS))
+    unchanged = ROWS[0][0]
+    (xmin_before,), = execute("SELECT xmin::text FROM corpus_export_state WHERE id = %s", (unchanged,))
+
+    execute("UPDATE assertion_details_formatted SET updated = '2025-03-01' WHERE id = %s", (ROWS[1][0],))
+    execute("DELETE FROM assertion_details_formatted WHERE id = %s", (ROWS[2][0],))
+    execute("INSERT INTO assertion_details_formatted VALUES ('00000000-0000-0000-0000-000000000004', '2025-03-02')")
+    assert record('delta', 2, deleted=1) == datetime.datetime(2025, 3, 2)
+
+    assert last_release()['export_type'] == 'delta'
+    assert state() == [
+        ROWS[0],
+        (ROWS[1][0], datetime.datetime(2025, 3, 1)),
+        ('00000000-0000-0000-0000-000000000004', datetime.datetime(2025, 3, 2)),
+    ]
+    (xmin_after,), = execute("SELECT xmin::text FROM corpus_export_state WHERE id = %s", (unchanged,))
+    assert xmin_after == xmin_before
+
+
+def test_takes_the_watermark_from_the_export_snapshot():
+    export_conn = connect(psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+    try:
+        with export_conn.cursor() as cur:
+            cur.execute("SELECT pg_export_snapshot()")
+            snapshot = cur.fetchone()[0]
+        # Changed after the export's snapshot, so left for the next delta
+        execute("UPDATE assertion_details_formatted SET updated = '2025-03-01' WHERE id = %s", (ROWS[0][0],))
+
+        max_updated = record('full', len(ROWS), snapshot=snapshot,
+                             isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+    finally:
+        export_conn.close()
+
+    assert max_updated == datetime.datetime(2025, 1, 3)
+    assert state() == ROWS
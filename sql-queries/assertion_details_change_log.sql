@@ -0,0 +1,99 @@
+-- Change log read by the incremental refresh of assertion_details_formatted.
+-- Triggers record every insert, update and delete on the tables the formatted rows are built from,
+-- so rows removed or edited in place without bumping `updated` (e.g. by cleanup_affiliations_funders.sql)
+-- are refreshed too. Each entry is either an assertion id (kind 'assertion') or the id of a changed
+-- affiliation, funder, subject, repository, publisher, journal or source, resolved to the assertions
+-- linked to it when the refresh runs. TRUNCATE bypasses the row triggers, so it is logged as a single
+-- 'truncate' entry instead, and the refresh then refuses to run until a full build has caught up.
+-- Run before a full build: once it succeeds, the build removes the entries logged before it started.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS assertion_details_changes (
+    kind TEXT NOT NULL,
+    id UUID, -- NULL for 'truncate' entries
+    logged_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION assertion_details_log_change() RETURNS trigger AS $$
+BEGIN
+    -- TG_ARGV[0] is the kind of the entry, TG_ARGV[1] the column holding its id
+    IF TG_OP <> 'INSERT' THEN
+        INSERT INTO assertion_details_changes (kind, id)
+            VALUES (TG_ARGV[0], (to_jsonb(OLD) ->> TG_ARGV[1])::uuid);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO assertion_details_changes (kind, id)
+            VALUES (TG_ARGV[0], (to_jsonb(NEW) ->> TG_ARGV[1])::uuid);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION assertion_details_log_truncate() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO assertion_details_changes (kind) VALUES ('truncate');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS assertion_details_log_change ON assertions;
+CREATE TRIGGER assertion_details_log_change AFTER INSERT OR UPDATE OR DELETE ON assertions
+    FOR EACH ROW EXECUTE FUNCTION assertion_details_log_change('assertion', 'id');
+
+DROP TRIGGER IF EXISTS assertion_details_log_change ON assertions_affiliations;
+CREATE TRIGGER assertion_details_log_change AFTER INSERT OR UPDATE OR DELETE ON assertions_affiliations
+    FOR EACH ROW EXECUTE FUNCTION assertion_details_log_change('assertion', 'assertion_id');
+
+DROP TRIGGER IF EXISTS assertion_details_log_change ON assertions_funders;
+CREATE TRIGGER assertion_details_log_change AFTER INSERT OR UPDATE OR DELETE ON assertions_funders
+    FOR EACH ROW EXECUTE FUNCTION assertion_details_log_change('assertion', 'assertion_id');
+
+DROP TRIGGER IF EXISTS assertion_details_log_change ON assertions_subjects;
+CREATE TRIGGER assertion_details_log_change AFTER INSERT OR UPDATE OR DELETE ON assertions_subjects
+    FOR EACH ROW EXECUTE FUNCTION assertion_details_log_change('assertion', 'assertion_id');
+
+-- New rows of the linked tables are not referenced by any assertion yet, so only updates and deletes are logged
+DROP TRIGGER IF EXISTS assertion_details_log_change ON affiliations;
+CREATE TRIGGER assertion_details_log_change AFTER UPDATE OR DELETE ON affiliations
+    FOR EACH ROW EXECUTE FUNCTION assertion_details_log_change('affiliation', 'id');
+
+DROP TRIGGER IF EXISTS assertion_details_log_change ON funders;
+CREATE TRIGGER assertion_details_log_change AFTER UPDATE OR DELETE ON funders
+    FOR EACH ROW EXECUTE FUNCTION assertion_details_log_change('funder', 'id');
+
+DROP TRIGGER IF EXISTS assertion_details_log_change ON subjects;
+CREATE TRIGGER assertion_details_log_change AFTER UPDATE OR DELETE ON subjects
+    FOR EACH ROW EXECUTE FUNCTION assertion_details_log_change('subject', 'id');
+
+DROP TRIGGER IF EXISTS assertion_details_log_change ON repositories;
+CREATE TRIGGER assertion_details_log_change AFTER UPDATE OR DELETE ON repositories
+    FOR EACH ROW EXECUTE FUNCTION assertion_details_log_change('repository', 'id');
+
+DROP TRIGGER IF EXISTS assertion_details_log_change ON publishers;
+CREATE TRIGGER assertion_details_log_change AFTER UPDATE OR DELETE ON publishers
+    FOR EACH ROW EXECUTE FUNCTION assertion_details_log_change('publisher', 'id');
+
+DROP TRIGGER IF EXISTS assertion_details_log_change ON journals;
+CREATE TRIGGER assertion_details_log_change AFTER UPDATE OR DELETE ON journals
+    FOR EACH ROW EXECUTE FUNCTION assertion_details_log_change('journal', 'id');
+
+DROP TRIGGER IF EXISTS assertion_details_log_change ON sources;
+CREATE TRIGGER assertion_details_log_change AFTER UPDATE OR DELETE ON sources
+    FOR EACH ROW EXECUTE FUNCTION assertion_details_log_change('source', 'id');
+
+DO $$
+DECLARE
+    source_table TEXT;
+BEGIN
+    FOREACH source_table IN ARRAY ARRAY['assertions', 'assertions_affiliations', 'assertions_funders',
+                                        'assertions_subjects', 'affiliations', 'funders', 'subjects',
+                                        'repositories', 'publishers', 'journals', 'sources'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS assertion_details_log_truncate ON %I', source_table);
+        EXECUTE format('CREATE TRIGGER assertion_details_log_truncate AFTER TRUNCATE ON %I '
+                       'FOR EACH STATEMENT EXECUTE FUNCTION assertion_details_log_truncate()', source_table);
+    END LOOP;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,206 @@
+-- Incremental refresh of assertion_details_formatted.
+-- Recomputes only the assertions that changed since the last build and upserts them. An assertion
+-- has changed if its own row, or one of its affiliations, funders or subjects, has an `updated` newer
+-- than the build recorded in assertion_details_build_state, or if the change log filled by the
+-- triggers of assertion_details_change_log.sql has an entry for it or for a row linked to it. The log
+-- catches links removed from an assertion that still exists and rows edited without bumping `updated`,
+-- as done by cleanup_affiliations_funders.sql. Rows of assertions logged as changed that no longer
+-- exist are deleted. Fails if a source table was truncated since the last full build, as the rows it
+-- removed were not logged.
+-- Requires a previous full build, which creates the unique index on id used by ON CONFLICT, run after
+-- assertion_details_change_log.sql.
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM assertion_details_changes WHERE kind = 'truncate') THEN
+        RAISE EXCEPTION 'A source table of assertion_details_formatted was truncated since the last build, run a full build instead';
+    END IF;
+END;
+$$;
+
+-- Take the logged changes; entries written while the refresh runs are kept for the next one
+CREATE TEMPORARY TABLE logged_changes (
+    kind TEXT NOT NULL,
+    id UUID NOT NULL
+) ON COMMIT DROP;
+WITH consumed AS (
+    DELETE FROM assertion_details_changes
+    RETURNING kind, id
+)
+INSERT INTO logged_changes
+    SELECT DISTINCT kind, id FROM consumed;
+ANALYZE logged_changes;
+
+CREATE TEMPORARY TABLE changed_assertions ON COMMIT DROP AS
+    SELECT a.id
+    FROM assertions a, assertion_details_build_state b
+    WHERE a.updated > b.built_at
+    UNION
+    SELECT aa.assertion_id
+    FROM assertions_affiliations aa
+    join affiliations aff
+    ON aff.id = aa.affiliation_id,
+    assertion_details_build_state b
+    WHERE aa.updated > b.built_at OR aff.updated > b.built_at
+    UNION
+    SELECT af.assertion_id
+    FROM assertions_funders af
+    join funders f
+    ON f.id = af.funder_id,
+    assertion_details_build_state b
+    WHERE af.updated > b.built_at OR f.updated > b.built_at
+    UNION
+    SELECT asub.assertion_id
+    FROM assertions_subjects asub
+    join subjects s
+    ON s.id = asub.subject_id,
+    assertion_details_build_state b
+    WHERE asub.updated > b.built_at OR s.updated > b.built_at
+    UNION
+    SELECT l.id
+    FROM logged_changes l
+    WHERE l.kind = 'assertion'
+    UNION
+    SELECT aa.assertion_id
+    FROM assertions_affiliations aa
+    join logged_changes l
+    ON l.kind = 'affiliation' AND l.id = aa.affiliation_id
+    UNION
+    SELECT af.assertion_id
+    FROM assertions_funders af
+    join logged_changes l
+    ON l.kind = 'funder' AND l.id = af.funder_id
+    UNION
+    SELECT asub.assertion_id
+    FROM assertions_subjects asub
+    join logged_changes l
+    ON l.kind = 'subject' AND l.id = asub.subject_id
+    UNION
+    SELECT a.id
+    FROM assertions a
+    join logged_changes l
+    ON l.kind = 'repository' AND l.id = a.repository_id
+    UNION
+    SELECT a.id
+    FROM assertions a
+    join logged_changes l
+    ON l.kind = 'publisher' AND l.id = a.publisher_id
+    UNION
+    SELECT a.id
+    FROM assertions a
+    join logged_changes l
+    ON l.kind = 'journal' AND l.id = a.journal_id
+    UNION
+    SELECT a.id
+    FROM assertions a
+    join logged_changes l
+    ON l.kind = 'source' AND l.id = a.source_id;
+ALTER TABLE changed_assertions ADD PRIMARY KEY (id);
+ANALYZE changed_assertions;
+
+DELETE FROM assertion_details_formatted adf
+    USING logged_changes l
+    WHERE l.kind = 'assertion'
+        AND adf.id = l.id
+        AND NOT EXISTS (SELECT 1 FROM assertions a WHERE a.id = l.id);
+
+INSERT INTO assertion_details_formatted (
+    id, created, updated, repository, publisher, journal, title, dataset, publication,
+    "publishedDate", source, affiliations, funders, subjects
+)
+select
+a.id,
+a.created as created,
+a.updated as updated,
+case
+    when r.title is not null or r.external_id is not null
+        then json_build_object('title', r.title, 'external_id', r.external_id)
+    else '{}'::json
+end repository,
+case
+    when p.title is not null or p.external_id is not null
+        then json_build_object('title', p.title, 'external_id', p.external_id)
+    else '{}'::json
+end publisher,
+case
+    when j.title is not null or j.external_id is not null
+        then json_build_object('title', j.title, 'external_id', j.external_id)
+    else '{}'::json
+end journal,
+a.title,
+a.dataset,
+a.publication,
+a.published_date as "publishedDate",
+s.abbreviation as source,
+coalesce(ga.affiliations, '[]'::json) as affiliations,
+coalesce(gf.funders, '[]'::json) as funders,
+coalesce(gs.subjects, '[]'::json) as subjects
+from changed_assertions as c
+join assertions as a
+    on a.id = c.id
+left join repositories as r
+    on r.id = a.repository_id
+left join publishers as p
+    on p.id = a.publisher_id
+left join journals as j
+    on j.id = a.journal_id
+left join sources as s
+    on s.id = a.source_id
+left join (
+    SELECT aa.assertion_id as id,
+    coalesce(json_agg(json_build_object('title', aff.title, 'external_id', aff.external_id, 'ror_name', aff.ror_name, 'ror_id', aff.ror_id)) filter (where aff.title is not null or aff.external_id is not null), '[]'::json) as affiliations
+    FROM changed_assertions c
+    join assertions_affiliations aa
+    on c.id = aa.assertion_id
+    join affiliations aff
+    ON aff.id = aa.affiliation_id
+    GROUP BY aa.assertion_id
+) as ga
+    on ga.id = a.id
+left join (
+    SELECT af.assertion_id as id,
+    coalesce(json_agg(json_build_object('title', f.title, 'external_id', f.external_id, 'ror_name', f.ror_name, 'ror_id', f.ror_id)) filter (where f.title is not null or f.external_id is not null), '[]'::json) as funders
+    FROM changed_assertions c
+    join assertions_funders af
+    on c.id = af.assertion_id
+    join funders f
+    ON f.id = af.funder_id
+    GROUP BY af.assertion_id
+) as gf
+    on gf.id = a.id
+left join (
+    SELECT asub.assertion_id as id,
+    coalesce(json_agg(sub.title) filter (where sub.title is not null), '[]'::json) as subjects
+    FROM changed_assertions c
+    join assertions_subjects asub
+    on c.id = asub.assertion_id
+    join subjects sub
+    ON sub.id = asub.subject_id
+    GROUP BY asub.assertion_id
+) as gs
+    on gs.id = a.id
+ON CONFLICT (id) DO UPDATE
+    SET created = EXCLUDED.created,
+        updated = EXCLUDED.updated,
+        repository = EXCLUDED.repository,
+        publisher = EXCLUDED.publisher,
+        journal = EXCLUDED.journal,
+        title = EXCLUDED.title,
+        dataset = EXCLUDED.dataset,
+        publication = EXCLUDED.publication,
+        "publishedDate" = EXCLUDED."publishedDate",
+        source = EXCLUDED.source,
+        affiliations = EXCLUDED.affiliations,
+        funders = EXCLUDED.funders,
+        subjects = EXCLUDED.subjects;
+
+-- now() is the start of this transaction, so changes made while it ran are picked up next time
+UPDATE assertion_details_build_state
+    SET build_type = 'incremental',
+        built_at = now();
+
+COMMIT;
+
+ANALYZE assertion_details_formatted;
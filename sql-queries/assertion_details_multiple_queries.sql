@@ -1,3 +1,7 @@
+-- Remember when the build started, so an incremental refresh picks up anything changed during it
+CREATE TEMPORARY TABLE assertion_details_build_started AS
+    SELECT now() AS started_at;
+
 BEGIN;
 DROP TABLE IF EXISTS assertion_details_formatted;
 COMMIT;
@@ -115,3 +119,32 @@ UPDATE assertion_details_formatted
 COMMIT;
 
 
+
+BEGIN;
+CREATE UNIQUE INDEX IF NOT EXISTS assertion_details_formatted_id_idx
+    ON assertion_details_formatted (id);
+COMMIT;
+
+BEGIN;
+CREATE TABLE IF NOT EXISTS assertion_details_build_state (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    build_type TEXT NOT NULL,
+    built_at TIMESTAMPTZ NOT NULL
+);
+INSERT INTO assertion_details_build_state (id, build_type, built_at)
+    SELECT TRUE, 'full', started_at
+    FROM assertion_details_build_started
+    ON CONFLICT (id) DO UPDATE
+        SET build_type = EXCLUDED.build_type,
+            built_at = EXCLUDED.built_at;
+-- Changes logged before the build started are in the new table. The change log is only there once
+-- assertion_details_change_log.sql has been run, as create_assertion_formatted_table.sh does.
+DO $$
+BEGIN
+    IF to_regclass('assertion_details_changes') IS NOT NULL THEN
+        DELETE FROM assertion_details_changes
+            WHERE logged_at < (SELECT started_at FROM assertion_details_build_started);
+    END IF;
+END;
+$$;
+COMMIT;
@@ -0,0 +1,118 @@
+-- Single-pass build of assertion_details_formatted.
+-- Produces the same table as assertion_details_multiple_queries.sql, but pre-aggregates
+-- affiliations, funders and subjects per assertion and joins them in one CREATE TABLE AS,
+-- instead of updating every row three more times. The table is built under a new name,
+-- indexed, and then swapped in atomically, so readers never see a half-built table.
+
+-- Remember when the build started, so an incremental refresh picks up anything changed during it
+CREATE TEMPORARY TABLE assertion_details_build_started AS
+    SELECT now() AS started_at;
+
+BEGIN;
+DROP TABLE IF EXISTS assertion_details_formatted_new;
+CREATE TABLE assertion_details_formatted_new AS
+with grouped_affiliations as (
+    SELECT aa.assertion_id as id,
+    coalesce(json_agg(json_build_object('title', aff.title, 'external_id', aff.external_id, 'ror_name', aff.ror_name, 'ror_id', aff.ror_id)) filter (where aff.title is not null or aff.external_id is not null), '[]'::json) as affiliations
+    FROM assertions_affiliations aa
+    join affiliations aff
+    ON aff.id = aa.affiliation_id
+    GROUP BY aa.assertion_id
+),
+grouped_funders as (
+    SELECT af.assertion_id as id,
+    coalesce(json_agg(json_build_object('title', f.title, 'external_id', f.external_id, 'ror_name', f.ror_name, 'ror_id', f.ror_id)) filter (where f.title is not null or f.external_id is not null), '[]'::json) as funders
+    FROM assertions_funders af
+    join funders f
+    ON f.id = af.funder_id
+    GROUP BY af.assertion_id
+),
+grouped_subjects as (
+    SELECT asub.assertion_id as id,
+    coalesce(json_agg(sub.title) filter (where sub.title is not null), '[]'::json) as subjects
+    FROM assertions_subjects asub
+    join subjects sub
+    ON sub.id = asub.subject_id
+    GROUP BY asub.assertion_id
+)
+select
+a.id,
+a.created as created,
+a.updated as updated,
+case
+    when r.title is not null or r.external_id is not null
+        then json_build_object('title', r.title, 'external_id', r.external_id)
+    else '{}'::json
+end repository,
+case
+    when p.title is not null or p.external_id is not null
+        then json_build_object('title', p.title, 'external_id', p.external_id)
+    else '{}'::json
+end publisher,
+case
+    when j.title is not null or j.external_id is not null
+        then json_build_object('title', j.title, 'external_id', j.external_id)
+    else '{}'::json
+end journal,
+a.title,
+a.dataset,
+a.publication,
+a.published_date as "publishedDate",
+s.abbreviation as source,
+coalesce(ga.affiliations, '[]'::json) as affiliations,
+coalesce(gf.funders, '[]'::json) as funders,
+coalesce(gs.subjects, '[]'::json) as subjects
+from assertions as a
+left join repositories as r
+    on r.id = a.repository_id
+left join publishers as p
+    on p.id = a.publisher_id
+left join journals as j
+    on j.id = a.journal_id
+left join sources as s
+    on s.id = a.source_id
+left join grouped_affiliations as ga
+    on ga.id = a.id
+left join grouped_funders as gf
+    on gf.id = a.id
+left join grouped_subjects as gs
+    on gs.id = a.id;
+
+ALTER TABLE assertion_details_formatted_new ALTER COLUMN affiliations set DEFAULT '[]'::json;
+ALTER TABLE assertion_details_formatted_new ALTER COLUMN funders set DEFAULT '[]'::json;
+ALTER TABLE assertion_details_formatted_new ALTER COLUMN subjects set DEFAULT '[]'::json;
+CREATE UNIQUE INDEX assertion_details_formatted_new_id_idx
+    ON assertion_details_formatted_new (id);
+COMMIT;
+
+BEGIN;
+DROP TABLE IF EXISTS assertion_details_formatted;
+ALTER TABLE assertion_details_formatted_new RENAME TO assertion_details_formatted;
+ALTER INDEX assertion_details_formatted_new_id_idx RENAME TO assertion_details_formatted_id_idx;
+COMMIT;
+
+ANALYZE assertion_details_formatted;
+
+BEGIN;
+CREATE TABLE IF NOT EXISTS assertion_details_build_state (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    build_type TEXT NOT NULL,
+    built_at TIMESTAMPTZ NOT NULL
+);
+INSERT INTO assertion_details_build_state (id, build_type, built_at)
+    SELECT TRUE, 'full', started_at
+    FROM assertion_details_build_started
+    ON CONFLICT (id) DO UPDATE
+        SET build_type = EXCLUDED.build_type,
+            built_at = EXCLUDED.built_at;
+-- Changes logged before the build started are in the new table. The change log is only there once
+-- assertion_details_change_log.sql has been run, as create_assertion_formatted_table.sh does.
+DO $$
+BEGIN
+    IF to_regclass('assertion_details_changes') IS NOT NULL THEN
+        DELETE FROM assertion_details_changes
+            WHERE logged_at < (SELECT started_at FROM assertion_details_build_started);
+    END IF;
+END;
+$$;
+COMMIT;